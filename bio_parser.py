@@ -0,0 +1,130 @@
+import codecs
+import html
+import os
+import re
+import sys
+import time
+
+
+RE_USERNAME = re.compile(r'@([a-zA-Z][\w\d]{4,31})')
+RE_META_TAG = re.compile(r'<meta\b[^>]*>', re.IGNORECASE)
+RE_ATTRIBUTE = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+RE_HEAD_END = re.compile(r'</head\s*>|<body\b', re.IGNORECASE)
+# the old way of scraping bios, kept as a reference for the benchmark below
+RE_SCRAPE_BIO = re.compile(r'<meta +property="og:description" +content="(.+?)".*>')
+
+
+class BioExtractor:
+    """
+    Incrementally parses a profile page, stopping as soon as the og:description tag has been read
+    Feed it chunks of text until feed() returns True, then read bio and usernames
+    """
+    def __init__(self):
+        self.buffer = ''
+        self.done = False
+        self.bio = None
+        self.usernames = []
+
+    def feed(self, chunk):
+        """Parses a chunk of the page, returns True once no more chunks are needed"""
+        if self.done:
+            return True
+
+        self.buffer += chunk
+        scanned = 0
+        for match in RE_META_TAG.finditer(self.buffer):
+            scanned = match.end()
+            attributes = {}
+            for name, double_quoted, single_quoted in RE_ATTRIBUTE.findall(match.group()):
+                attributes[name.lower()] = double_quoted or single_quoted
+
+            if attributes.get('property') == 'og:description' and 'content' in attributes:
+                self.bio = html.unescape(attributes['content'])
+                self.usernames = RE_USERNAME.findall(self.bio)
+                self.done = True
+                return True
+
+        # the meta tags all live in the head, so give up once it's over
+        if RE_HEAD_END.search(self.buffer, scanned):
+            self.done = True
+            return True
+
+        # only keep what could be the start of an unfinished tag
+        tag_start = self.buffer.rfind('<', scanned)
+        self.buffer = self.buffer[tag_start:] if tag_start != -1 else ''
+        return False
+
+
+def extract_bio(text, chunk_size=4096):
+    """Runs a BioExtractor over a whole page, returns the extractor"""
+    extractor = BioExtractor()
+    for i in range(0, len(text), chunk_size):
+        if extractor.feed(text[i:i + chunk_size]):
+            break
+    return extractor
+
+
+def _regex_usernames(raw):
+    bio = RE_SCRAPE_BIO.findall(raw.decode('utf-8'))
+    return RE_USERNAME.findall(bio[0]) if bio else None
+
+
+def _stream_usernames(raw, chunk_size=4096):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    extractor = BioExtractor()
+    for i in range(0, len(raw), chunk_size):
+        if extractor.feed(decoder.decode(raw[i:i + chunk_size])):
+            break
+    return extractor.usernames if extractor.bio is not None else None
+
+
+def _example_page(bio, padding=40000):
+    return (
+        '<!DOCTYPE html>\n<html>\n<head>\n'
+        '<meta charset="utf-8">\n<title>Telegram: Contact @example</title>\n'
+        '<meta property="og:title" content="Example">\n'
+        '<meta property="og:image" content="https://cdn.example/i.jpg">\n'
+        '<meta property="og:site_name" content="Telegram">\n'
+        '<meta property="og:description" content="{}">\n'
+        '<meta property="twitter:card" content="summary">\n'
+        '</head>\n<body>\n{}</body>\n</html>\n'
+    ).format(html.escape(bio), '<div class="filler">&nbsp;</div>\n' * (padding // 33))
+
+
+if __name__ == '__main__':
+    extractor = extract_bio(_example_page('next is @some_user &amp; @other_user <3'))
+    assert extractor.bio == 'next is @some_user &amp; @other_user <3'
+    assert extractor.usernames == ['some_user', 'other_user']
+
+    # tags split across chunks and bios with newlines
+    extractor = extract_bio(_example_page('line one\n@first_user\nline three'), chunk_size=7)
+    assert extractor.usernames == ['first_user']
+
+    extractor = extract_bio('<html><head><title>nothing</title></head><body>@not_a_bio</body></html>')
+    assert extractor.done and extractor.bio is None
+
+    # benchmark against the regex on a corpus of saved pages
+    # usage: python bio_parser.py [directory of saved .html pages]
+    if sys.argv[1:]:
+        corpus = []
+        for filename in sorted(os.listdir(sys.argv[1])):
+            with open(os.path.join(sys.argv[1], filename), 'rb') as f:
+                corpus.append(f.read())
+    else:
+        corpus = [
+            _example_page('bio number {} -> @user_{:05d}'.format(i, i)).encode('utf-8')
+            for i in range(200)
+        ]
+
+    for name, function in (('regex', _regex_usernames), ('stream', _stream_usernames)):
+        rounds = 20
+        start = time.perf_counter()
+        for i in range(rounds):
+            results = [function(raw) for raw in corpus]
+        elapsed = time.perf_counter() - start
+        print('{:>6}: {:.3f}ms per page, {} of {} pages scraped'.format(
+            name,
+            elapsed / rounds / len(corpus) * 1000,
+            sum(1 for result in results if result is not None),
+            len(corpus)
+        ))
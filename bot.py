@@ -6,10 +6,15 @@ from signal import signal, SIGINT, SIGTERM, SIGABRT
 import logging
 
 from database import Database
+from change_stream import ChangeStream
+from history import ChainHistory
+from memory_monitor import MemoryMonitor
 import commands
 from util import *
 
 DATABASE_FILENAME = 'db.json'
+SNAPSHOT_FILENAME = 'snapshot.json'
+HISTORY_FILENAME = 'history'
 LAST_CHAIN = FileString('last_chain.txt')
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -94,33 +99,14 @@ def handle_update_command(db, update):
 
     message = update.message
 
-    if message.forward_from or not message.text or not message.text.startswith('/'):
+    if message.forward_from or not message.text:
         return False
 
-    command_split = message.text[1:].split(' ', 1)
-    command_args = command_split[1:] or ''
-
-    directed = False
-    command = command_split[0].lower().split('@')
-    if command[1:]:
-        # the command was directed to a bot
-        directed = True
-    command.append(message.bot.username)
-    if command[1] != message.bot.username:
-        # this command is not for us
-        return False
-
-    try:
-        getattr(commands, 'cmd_' + command[0])(db, update, directed, command_args)
-    except AttributeError:
-        if directed:
-            print('got unknown command:', message.text)
-
-    return True
+    return commands.registry.dispatch(db, update, message.bot.username)
 
 
 def on_error(bot, update, error):
-    send_message_pre(bot, error + '\n\n' + update, 232787997)
+    send_message_pre(bot, error + '\n\n' + update, ADMIN_CHAT_ID)
     logger.warning('Update "%s" caused error "%s"', update, error)
 
 
@@ -131,30 +117,8 @@ def main():
         else:
             exit(1)
 
-    def sandwich(bot, update):
-        bot.send_message(chat_id=update.message.chat_id, text="Not my job!")
-        
     def on_command(bot, update):
-        message = update.message
-
-        command_split = message.text[1:].split(' ', 1)
-        command_args = command_split[1:] or ''
-
-        command = command_split[0].lower().split('@')
-        directed = bool(command[1:])
-        command.append(bot.username)
-        if command[1].lower() != bot.username.lower():
-            # this command is not for us
-            return
-
-        try:
-            if (command[0] == "sandwich"):
-                sandwich(bot, update)
-            else:
-                getattr(commands, 'cmd_' + command[0].lower())(db, update, directed, command_args)
-        except AttributeError:
-            if directed:
-                print('got unknown command:', message.text)
+        commands.registry.dispatch(db, update, bot.username)
 
 
     def on_new_members(bot, update):
@@ -182,13 +146,17 @@ def main():
 
 
     def on_left_member(bot, update):
-        left_id = str(update.message.left_chat_member.id)
-        if left_id in db.users:
-            db.users[left_id].username_fetch_failed = True
+        db.mark_fetch_failed(str(update.message.left_chat_member.id))
             
 
     db = Database(DATABASE_FILENAME)
-    db.update_best_chain(END_NODE)
+    if db.load_snapshot(SNAPSHOT_FILENAME, END_NODE):
+        print('Restored best chain from snapshot')
+    else:
+        db.update_best_chain(END_NODE)
+        db.save()
+        db.save_snapshot(SNAPSHOT_FILENAME, END_NODE)
+    print('Spread {} overdue refreshes'.format(db.spread_expiries(RESTART_SPREAD_SECONDS)))
     
     updater = Updater(token=TOKEN)
     bot = updater.bot
@@ -203,23 +171,40 @@ def main():
     for sig in (SIGINT, SIGTERM, SIGABRT):
         signal(sig, on_signal)
 
-    pending_changes = []
+    change_stream = ChangeStream(DEBOUNCE_SECONDS, MAX_LATENCY_SECONDS)
+    history = ChainHistory(HISTORY_FILENAME)
+    memory_monitor = None
+    if MEMORY_DIAGNOSTICS:
+        memory_monitor = MemoryMonitor(MEMORY_SNAPSHOT_INTERVAL, MEMORY_SAMPLE_SECONDS, MEMORY_ALARM_THRESHOLD)
     while updater.running:
         try:
+            # warn the admin if memory keeps growing
+            memory_report = memory_monitor.check(db) if memory_monitor else None
+            if memory_report:
+                send_message_pre(bot, memory_report, ADMIN_CHAT_ID)
+
             # try to update the user who expires next
             changes, user_was_updated = db.update_first_expired(bot)
             if not user_was_updated:
                 time.sleep(1)
 
-            pending_changes.extend(changes)
+            change_stream.extend(changes)
 
-            if db.get_expired_count() > 0 or not pending_changes:
+            # wait for bursts of changes to settle before rebuilding
+            if not change_stream.is_ready(settled=db.get_expired_count() == 0):
+                continue
+            pending_changes = change_stream.drain()
+            if not pending_changes:
+                # everything in this window cancelled out
                 continue
 
             # rebuild the best chain
             last_head = db.get_head_user_id()
             db.update_best_chain(END_NODE)
 
+            # keep a record of how the chain changes over time
+            history.record(db.best_chain, db.view.valid_length, db.get_head_user_id())
+
             # post the best chain if it's different to the old one
             update_chain(bot, db.stringify_chain(db.best_chain))
 
@@ -227,27 +212,27 @@ def main():
             if db.get_head_user_id() != last_head:
                 send_message(bot, db.get_branch_announcements())
 
+            # shout once about any new loops
+            send_message(bot, db.get_cycle_announcements())
+
             # shout at users whose data has changed
             for pending_change in pending_changes:
                 send_message(bot, pending_change.shout(db))
-            pending_changes.clear()
+            change_stream.mark_posted()
+            print('Change stream:', change_stream)
 
             # disable users who we failed to fetch a username for and aren't in the chain
-            for user_id in db.users:
-                if not db.users[user_id].username_fetch_failed:
-                    continue
-                print('rechecking', db.users[user_id].str_with_id())
-                if user_id not in db.best_chain:
-                    db.disable_user(user_id)
+            db.reconcile_fetch_failed()
 
             # Get rid of old non-existent links if the chain passes through only real links
             if db.best_chain_is_valid:
                 print('Purged {} dead links'.format(db.clear_dead_links()))
             db.save()
+            db.save_snapshot(SNAPSHOT_FILENAME, END_NODE)
         except Exception as e:
             #raise e
             print('Encountered exception while running main loop:', type(e))
-            send_message_pre(bot, traceback.format_exc(), 232787997)
+            send_message_pre(bot, traceback.format_exc(), ADMIN_CHAT_ID)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+import matrix
+from simulation import Simulator
+from util import *
+
+
+class ChainView:
+    """
+    Read-only model of the best chain and its branches that query commands are answered from
+    Everything is copied out of the database when the view is built, and answers are memoized,
+    so queries never touch the live LinkMatrix, which the main loop rebuilds while commands are handled.
+    What-if simulations run on the view's own copy of the links. A new view (with a new version) is
+    built for every new chain
+    """
+    def __init__(self, db, version, end_node):
+        self.version = version
+        self.end_node = end_node
+        self.chain = list(db.best_chain)
+        self.translation_table = db.translation_table
+        self.names = {}
+        self.cache = {}
+
+        # real[i] is True if chain[i] really links to chain[i+1]
+        self.real = self.__get_link_states(db, self.chain)
+        self.position = {user_id: i for i, user_id in enumerate(self.chain)}
+        self.head_index = 0
+        for i, user_id in enumerate(self.chain):
+            if db.users[user_id].username:
+                self.head_index = i
+                break
+
+        self.valid_length = 1
+        for is_real in reversed(self.real):
+            if not is_real:
+                break
+            self.valid_length += 1
+
+        # branches are stored up to (and including) the user they merge into the chain at
+        self.branches = []
+        self.branch_of = {}
+        for branch in db.branches:
+            branch_point_i, merger_i = db.matrix.chain_get_merge_points(db.best_chain, branch)
+            if branch[merger_i] in self.position:
+                continue
+            branch = branch[:merger_i + 2]
+            self.branches.append((branch, self.__get_link_states(db, branch)))
+            for user_id in branch[:-1]:
+                self.branch_of.setdefault(user_id, len(self.branches) - 1)
+
+        for user_id in list(self.position) + list(self.branch_of):
+            self.names[user_id] = str(db.users[user_id])
+
+        # for simulations, which are only set up when first asked for
+        self.matrix = db.matrix.copy()
+        self.all_branches = list(db.branches)
+        self.joined = db.get_joined_timestamps()
+        self.simulator = None
+
+    def __get_link_states(self, db, chain):
+        return [
+            db.matrix.get_link_to(chain[i - 1], chain[i]) is matrix.State.REAL
+            for i in range(1, len(chain))
+        ]
+
+    def __memoize(self, key, function, *args):
+        if key not in self.cache:
+            self.cache[key] = function(*args)
+        return self.cache[key]
+
+    def __name(self, user_id):
+        return '<code>{}</code>'.format(html_escape(self.names[user_id]))
+
+    def __join(self, chain, real):
+        text = ''
+        for i, user_id in enumerate(chain[:-1]):
+            text += html_escape(self.names[user_id]) + (' -> ' if real[i] else ' X ')
+        return text + html_escape(self.names[chain[-1]])
+
+    def __get_simulator(self):
+        if self.simulator is None:
+            self.simulator = Simulator(
+                self.matrix, self.all_branches, self.joined, self.end_node, self.chain[self.head_index]
+            )
+        return self.simulator
+
+    def get_user_id(self, username):
+        """Looks up a username (with or without the @) as it was when the view was built"""
+        return self.translation_table.get(username.lstrip('@').lower())
+
+    def whois(self, user_id):
+        return self.__memoize(('whois', user_id), self.__whois, user_id)
+
+    def __whois(self, user_id):
+        if user_id in self.position:
+            position = self.position[user_id]
+            distance = position - self.head_index
+            if distance == 0:
+                where = 'and is the head!'
+            elif distance < 0:
+                # users without a username can't be linked to, so they come before the head
+                where = 'before the head'
+            else:
+                where = '{} link{} from the head'.format(distance, 's' if distance != 1 else '')
+            return '{} is #{} of {} in the chain, {}'.format(
+                self.__name(user_id),
+                position + 1,
+                len(self.chain),
+                where
+            )
+
+        if user_id in self.branch_of:
+            branch, real = self.branches[self.branch_of[user_id]]
+            return '{} is on a branch that joins the chain at {} (#{})'.format(
+                self.__name(user_id),
+                self.__name(branch[-1]),
+                self.position[branch[-1]] + 1
+            )
+
+        return 'That user isn\'t in the chain'
+
+    def path(self, user_id):
+        return self.__memoize(('path', user_id), self.__path, user_id)
+
+    def __path(self, user_id):
+        if user_id in self.position:
+            position = self.position[user_id]
+            return self.__join(self.chain[position:], self.real[position:])
+
+        if user_id in self.branch_of:
+            branch, real = self.branches[self.branch_of[user_id]]
+            position = branch.index(user_id)
+            merge = self.position[branch[-1]]
+            return self.__join(branch[position:] + self.chain[merge + 1:], real[position:] + self.real[merge:])
+
+        return 'That user isn\'t in the chain'
+
+    def branch(self, user_id):
+        return self.__memoize(('branch', user_id), self.__branch, user_id)
+
+    def __branch(self, user_id):
+        if user_id in self.position:
+            return '{} is in the main chain'.format(self.__name(user_id))
+
+        if user_id in self.branch_of:
+            branch, real = self.branches[self.branch_of[user_id]]
+            return '{} is on a branch of {} that merges into the chain at {}:\n{}'.format(
+                self.__name(user_id),
+                len(branch) - 1,
+                self.__name(branch[-1]),
+                self.__join(branch, real)
+            )
+
+        return 'That user isn\'t in the chain'
+
+    def list_branches(self):
+        return self.__memoize(('branches',), self.__list_branches)
+
+    def __list_branches(self):
+        if not self.branches:
+            return 'There are no branches'
+
+        lines = []
+        for branch, real in self.branches:
+            lines.append(BULLET + '{} ({} long) merges at {}'.format(
+                self.__name(branch[0]),
+                len(branch) - 1,
+                self.__name(branch[-1])
+            ))
+        return '\n'.join(lines)
+
+    def chain_page(self, page):
+        """Returns the text for a page (starting at 1) of the chain"""
+        page_count = max(1, (len(self.chain) + CHAIN_PAGE_SIZE - 1) // CHAIN_PAGE_SIZE)
+        page = min(max(page, 1), page_count)
+        return self.__memoize(('chain', page), self.__chain_page, page, page_count)
+
+    def __chain_page(self, page, page_count):
+        start = (page - 1) * CHAIN_PAGE_SIZE
+        lines = ['Chain length: {} ({} without breaks), page {}/{}\n'.format(
+            len(self.chain), self.valid_length, page, page_count
+        )]
+        for i in range(start, min(start + CHAIN_PAGE_SIZE, len(self.chain))):
+            lines.append('{}. {}{}'.format(
+                i + 1,
+                html_escape(self.names[self.chain[i]]),
+                ' X' if i < len(self.real) and not self.real[i] else ''
+            ))
+        return '\n'.join(lines)
+
+    def whatif(self, linker, linked):
+        """Returns how long the chain would be if linker's bio only linked to linked"""
+        return self.__memoize(('whatif', linker, linked), self.__whatif, linker, linked)
+
+    def __whatif(self, linker, linked):
+        result = self.__get_simulator().evaluate_fix(linker, linked)
+        return 'Chain length: {} ({:+}), {} without breaks ({:+})'.format(
+            result.length, result.length_gain, result.valid_length, result.valid_gain
+        )
+
+    def suggest(self):
+        """Returns the link fixes that would grow the chain the most"""
+        return self.__memoize(('suggest',), self.__suggest)
+
+    def __suggest(self):
+        lines = []
+        for result in self.__get_simulator().suggest_repairs():
+            linker, linked, state = result.link_changes[0]
+            lines.append(BULLET + '{} -> {}: {:+} ({:+} without breaks)'.format(
+                html_escape(self.names[linker]), html_escape(self.names[linked]), result.length_gain, result.valid_gain
+            ))
+        return '\n'.join(lines) or 'No fixes would make the chain longer'
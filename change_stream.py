@@ -0,0 +1,115 @@
+import time
+
+
+class ChangeStream:
+    """
+    Collects changes between chain rebuilds
+    Repeated changes for the same user are merged into one, and the stream is only
+    ready for a rebuild once it has been quiet for `debounce` seconds (or once the
+    oldest pending change is `max_latency` seconds old)
+    """
+    def __init__(self, debounce, max_latency):
+        self.debounce = debounce
+        self.max_latency = max_latency
+
+        # {(change type, user_id): change}, in the order they were first seen
+        self.pending = {}
+        self.first_seen = None
+        self.last_seen = None
+
+        # stats
+        self.rebuilds = 0
+        self.received = 0
+        self.merged = 0
+        self.total_latency = 0
+        self.max_seen_latency = 0
+        self.window_start = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def extend(self, changes):
+        now = time.time()
+        for change in changes:
+            self.received += 1
+            key = (type(change), change.user_id)
+            if key in self.pending:
+                self.pending[key] = self.pending[key].merge(change)
+                self.merged += 1
+            else:
+                self.pending[key] = change
+
+            if self.first_seen is None:
+                self.first_seen = now
+            self.last_seen = now
+
+    def is_ready(self, settled=True):
+        """
+        Returns True if the pending changes should be applied now
+        settled should be False while there are still users waiting to be refreshed
+        """
+        if not self.pending:
+            return False
+
+        now = time.time()
+        if now - self.first_seen >= self.max_latency:
+            return True
+
+        return settled and now - self.last_seen >= self.debounce
+
+    def drain(self):
+        """Returns the pending changes (without ones that cancelled out) and starts a new window"""
+        changes = [change for change in self.pending.values() if not change.is_noop()]
+
+        self.window_start = self.first_seen
+        self.pending = {}
+        self.first_seen = None
+        self.last_seen = None
+
+        return changes
+
+    def mark_posted(self):
+        """Records that the changes from the last drain() have been posted"""
+        self.rebuilds += 1
+        if self.window_start is None:
+            return
+
+        latency = time.time() - self.window_start
+        self.total_latency += latency
+        self.max_seen_latency = max(self.max_seen_latency, latency)
+        self.window_start = None
+
+    def __str__(self):
+        average = self.total_latency / self.rebuilds if self.rebuilds else 0
+        return 'rebuilds: {}, changes: {} ({} merged), latency: {:.1f}s avg, {:.1f}s max'.format(
+            self.rebuilds,
+            self.received,
+            self.merged,
+            average,
+            self.max_seen_latency
+        )
+
+
+if __name__ == '__main__':
+    import changes
+
+    stream = ChangeStream(0, 60)
+    assert not stream.is_ready()
+
+    stream.extend([changes.Bio('1', ['a'], ['b'])])
+    stream.extend([changes.Bio('1', ['b'], ['c']), changes.Username('2', 'x', 'y')])
+    assert len(stream) == 2
+    assert stream.is_ready()
+    assert not stream.is_ready(settled=False)
+
+    drained = stream.drain()
+    assert len(drained) == 2
+    assert drained[0].last == ['a'] and drained[0].current == ['c']
+    stream.mark_posted()
+
+    # a change that is undone within the window cancels out
+    stream.extend([changes.Username('2', 'y', 'z'), changes.Username('2', 'z', 'Y')])
+    assert stream.drain() == []
+    stream.mark_posted()
+
+    print(stream)
@@ -10,9 +10,20 @@ class Base:
 
     def __str__(self):
         return '{} {}: {} -> {}'.format(type(self), self.user_id, self.last, self.current)
+
+    def merge(self, other):
+        """Returns a change going from this change's last value to other's current value"""
+        return type(self)(self.user_id, self.last, other.current)
+
+    def is_noop(self):
+        return self.last == self.current
         
 
+
 class Username(Base):
+    def is_noop(self):
+        return (self.last or '').lower() == (self.current or '').lower()
+
     def shout(self, db):
         shouts = []
         if self.current != self.last:
@@ -46,6 +57,9 @@ class Username(Base):
 
 
 class Bio(Base):
+    def is_noop(self):
+        return caseless_set_eq(self.last, self.current)
+
     def _get_shout_from_list(self, l, prefix):
         return BULLET + prefix + ' remove their unnecessary link{} to <code>{}</code>!'.format(
                 's' if len(l) > 1 else '',
@@ -0,0 +1,153 @@
+import time
+from collections import deque
+
+from util import *
+
+
+class ParsedCommand:
+    def __init__(self, name, directed, args):
+        self.name = name
+        # True if the command was addressed to us with @botname
+        self.directed = directed
+        # [] or a list containing everything after the command
+        self.args = args
+
+
+def parse_command(text, bot_username):
+    """Returns a ParsedCommand, or None if text isn't a command meant for bot_username"""
+    if not text or not text.startswith('/'):
+        return None
+
+    command_split = text[1:].split(None, 1)
+    if not command_split:
+        return None
+
+    name, _, target = command_split[0].partition('@')
+    if target and target.lower() != bot_username.lower():
+        # this command is for another bot
+        return None
+
+    return ParsedCommand(name.lower(), bool(target), command_split[1:])
+
+
+class Command:
+    """A command handler, its limits and how long it's been taking"""
+    def __init__(self, name, handler, cooldown, rate_limit, hidden):
+        self.name = name
+        self.handler = handler
+        self.cooldown = cooldown
+        self.rate_limit = rate_limit
+        self.hidden = hidden
+
+        # {user_id: time the user last ran this command}
+        self.last_used = {}
+        # times this command was run within the last COMMAND_RATE_WINDOW seconds
+        self.recent = deque()
+
+        # stats
+        self.calls = 0
+        self.rejected = 0
+        self.total_time = 0
+        self.max_time = 0
+
+    def allow(self, user_id, now):
+        """Returns True if user_id may run this command now, and records it if so"""
+        if self.cooldown and now - self.last_used.get(user_id, -self.cooldown) < self.cooldown:
+            return False
+
+        if self.rate_limit:
+            while self.recent and now - self.recent[0] >= COMMAND_RATE_WINDOW:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                return False
+            self.recent.append(now)
+
+        if self.cooldown:
+            self.last_used[user_id] = now
+        return True
+
+    def get_help(self):
+        return self.handler.__doc__ or '/{} - no help available'.format(self.name)
+
+    def __str__(self):
+        return '/{}: {} calls ({} rejected), {:.1f}ms avg, {:.1f}ms max'.format(
+            self.name,
+            self.calls,
+            self.rejected,
+            self.total_time / self.calls * 1000 if self.calls else 0,
+            self.max_time * 1000
+        )
+
+
+class CommandRegistry:
+    """Maps command names to handlers, which are called as handler(db, update, directed, command_args)"""
+    def __init__(self):
+        self.commands = {}
+
+    def command(self, name=None, cooldown=0, rate_limit=None, hidden=False):
+        """
+        Decorator that registers a handler, named after the function without its cmd_ prefix by default
+        cooldown: seconds a user has to wait before running the command again
+        rate_limit: most times the command can be run by anyone within COMMAND_RATE_WINDOW seconds
+        hidden: leave the command out of the help text
+        """
+        def register(handler):
+            command_name = name or handler.__name__[len('cmd_'):]
+            self.commands[command_name] = Command(command_name, handler, cooldown, rate_limit, hidden)
+            return handler
+        return register
+
+    def get_help_text(self):
+        return '\n'.join(command.get_help() for command in self.commands.values() if not command.hidden)
+
+    def dispatch(self, db, update, bot_username):
+        """
+        Runs the command in update's message
+        Returns False if the message wasn't a command for us, True otherwise
+        """
+        message = update.message
+        parsed = parse_command(message.text, bot_username)
+        if not parsed:
+            return False
+
+        command = self.commands.get(parsed.name)
+        if not command:
+            if parsed.directed:
+                print('got unknown command:', message.text)
+            return True
+
+        start = time.perf_counter()
+        if not command.allow(message.from_user.id, time.monotonic()):
+            command.rejected += 1
+            return True
+
+        try:
+            command.handler(db, update, parsed.directed, parsed.args)
+        finally:
+            elapsed = time.perf_counter() - start
+            command.calls += 1
+            command.total_time += elapsed
+            command.max_time = max(command.max_time, elapsed)
+
+        return True
+
+    def get_stats(self):
+        return '\n'.join(str(command) for command in self.commands.values())
+
+
+if __name__ == '__main__':
+    parsed = parse_command('/Whois@Bio_Chain_Bot @someone', 'bio_chain_bot')
+    assert parsed.name == 'whois' and parsed.directed and parsed.args == ['@someone']
+    parsed = parse_command('/chain', 'bio_chain_bot')
+    assert parsed.name == 'chain' and not parsed.directed and parsed.args == []
+    assert parse_command('/chain@other_bot 2', 'bio_chain_bot') is None
+    assert parse_command('not a command', 'bio_chain_bot') is None
+
+    command = Command('test', None, 10, 2, False)
+    assert command.allow(1, 0)
+    assert not command.allow(1, 5)
+    assert command.allow(2, 5)
+    assert not command.allow(3, 6)
+    assert command.allow(3, 61)
+    assert not command.allow(1, 62)
+    assert command.allow(1, 66)
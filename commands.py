@@ -1,6 +1,11 @@
+from command_registry import CommandRegistry
 from util import *
 
 
+registry = CommandRegistry()
+
+
+@registry.command(cooldown=30)
 def cmd_help(db, update, directed, command_args):
     """/help - shows this message"""
     if not directed:
@@ -9,6 +14,7 @@ def cmd_help(db, update, directed, command_args):
     update.message.reply_text(help_text, parse_mode='Markdown')
 
 
+@registry.command(cooldown=10, rate_limit=10)
 def cmd_pin(db, update, directed, command_args):
     """/pin - quotes the current pin message"""
     if update.message.chat.id != CHAT_ID:
@@ -18,14 +24,86 @@ def cmd_pin(db, update, directed, command_args):
     update.message.reply_text('^', reply_to_message_id=LAST_PIN.get())
 
 
-help_text = []
-for name, attr in locals().copy().items():
-    if callable(attr) and name.startswith('cmd_'):
-        doc = attr.__doc__
-        if doc:
-            help_text.append(doc)
-        else:
-            help_text.append('/{} - no help available'.format(
-                attr[4:],
-            ))
-help_text = '\n'.join(help_text)
+def is_admin(update):
+    return (update.message.from_user.username or '').lower() == ADMIN.lower()
+
+
+def get_target_id(db, update, command_args):
+    """Returns the user ID given as a username in command_args, or the sender's if there isn't one"""
+    if command_args and command_args[0].strip():
+        return db.view.get_user_id(command_args[0].split()[0])
+    return str(update.message.from_user.id)
+
+
+@registry.command(cooldown=10, rate_limit=30)
+def cmd_chain(db, update, directed, command_args):
+    """/chain [page] - lists the chain, a page at a time"""
+    page = 1
+    if command_args and command_args[0].strip().isdigit():
+        page = int(command_args[0].strip())
+
+    update.message.reply_text(db.view.chain_page(page), parse_mode='HTML')
+
+
+@registry.command(cooldown=10, rate_limit=30)
+def cmd_whois(db, update, directed, command_args):
+    """/whois [@user] - shows where you (or @user) are in the chain"""
+    update.message.reply_text(db.view.whois(get_target_id(db, update, command_args)), parse_mode='HTML')
+
+
+@registry.command(cooldown=10, rate_limit=30)
+def cmd_path(db, update, directed, command_args):
+    """/path [@user] - shows the path from you (or @user) to the end of the chain"""
+    update.message.reply_text(db.view.path(get_target_id(db, update, command_args)), parse_mode='HTML')
+
+
+@registry.command(cooldown=10, rate_limit=30)
+def cmd_branches(db, update, directed, command_args):
+    """/branches [@user] - lists the branches, or shows the branch you (or @user) are on"""
+    if command_args and command_args[0].strip():
+        text = db.view.branch(get_target_id(db, update, command_args))
+    else:
+        text = db.view.list_branches()
+
+    update.message.reply_text(text, parse_mode='HTML')
+
+
+@registry.command(hidden=True)
+def cmd_sandwich(db, update, directed, command_args):
+    update.message.bot.send_message(chat_id=update.message.chat_id, text="Not my job!")
+
+
+@registry.command(hidden=True)
+def cmd_stats(db, update, directed, command_args):
+    """/stats - shows how often commands are used and how long they take"""
+    if not is_admin(update):
+        return
+
+    update.message.reply_text('<pre>{}</pre>'.format(html_escape(registry.get_stats())), parse_mode='HTML')
+
+
+@registry.command(cooldown=10, hidden=True)
+def cmd_whatif(db, update, directed, command_args):
+    """/whatif @user @target - shows how long the chain would be if @user's bio only linked to @target"""
+    if not is_admin(update):
+        return
+
+    usernames = command_args[0].split() if command_args else []
+    user_ids = [db.view.get_user_id(username) for username in usernames[:2]]
+    if len(user_ids) != 2 or None in user_ids:
+        update.message.reply_text('Usage: /whatif @user @target')
+        return
+
+    update.message.reply_text(db.view.whatif(*user_ids))
+
+
+@registry.command(cooldown=30, hidden=True)
+def cmd_suggest(db, update, directed, command_args):
+    """/suggest - lists the link fixes that would grow the chain the most"""
+    if not is_admin(update):
+        return
+
+    update.message.reply_text(db.view.suggest(), parse_mode='HTML')
+
+
+help_text = registry.get_help_text()
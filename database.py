@@ -1,8 +1,12 @@
 import os
 import json
+import random
+import hashlib
 import requests
 from user import User
 import matrix
+import parallel
+from chain_view import ChainView
 from util import *
 
 
@@ -33,14 +37,24 @@ class Database:
         # storage for update_translation_table()
         self.translation_table = {}
 
+        # users that we failed to fetch a username for: {user_id: [next retry timestamp, retries]}
+        self.fetch_failed = {}
+
         # storage for update_best_chain()
         self.best_chain = []
+        self.best_chain_set = set()
         self.branches = []
         self.best_chain_is_valid = True
 
-    def save(self):
-        print('Saving db...')
+        # read model for query commands, rebuilt with the best chain
+        self.chain_version = 0
+        self.view = None
 
+        # storage for get_cycle_announcements()
+        self.announced_cycles = set()
+
+    def to_dict(self):
+        """Returns the data that gets saved to the db file"""
         data = {}
         for user_id, user in self.users.items():
             data[user_id] = user.to_dict()
@@ -52,8 +66,84 @@ class Database:
                     is_dead = self.matrix.get_link_to(user_id, link_id) is matrix.State.DEAD
                     data[user_id]['links_to'].append(('!' if is_dead else '') + link_id)
 
+        return data
+
+    def save(self):
+        print('Saving db...')
+
         with open(self.filename, 'w') as f:
-            json.dump(data, f)
+            json.dump(self.to_dict(), f)
+
+    def get_state_stamp(self):
+        """Returns a hash of everything that the best chain is derived from"""
+        data = self.to_dict()
+        for user_data in data.values():
+            # expiry times change all the time and don't affect the chain
+            user_data.pop('expires', None)
+
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def save_snapshot(self, filename, end_node):
+        """Saves the state computed by update_best_chain() so that it can be restored on restart"""
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'stamp': self.get_state_stamp(),
+            'end_node': end_node,
+            'created': get_current_timestamp(),
+            'best_chain': self.best_chain,
+            'branches': self.branches,
+            'best_chain_is_valid': self.best_chain_is_valid,
+            'translation_table': self.translation_table,
+            'announced_cycles': [sorted(cycle) for cycle in self.announced_cycles],
+            'expires': {user_id: user.expires for user_id, user in self.users.items() if user.expires},
+        }
+
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(filename + '.tmp', filename)
+
+    def load_snapshot(self, filename, end_node):
+        """
+        Restores the state saved by save_snapshot()
+        Returns False (without changing anything) if there's no snapshot or if it doesn't match the db
+        """
+        try:
+            with open(filename) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('end_node') != end_node:
+            return False
+        if snapshot.get('stamp') != self.get_state_stamp():
+            print('Snapshot is out of date')
+            return False
+
+        self.best_chain = snapshot['best_chain']
+        self.best_chain_set = set(self.best_chain)
+        self.branches = snapshot['branches']
+        self.best_chain_is_valid = snapshot['best_chain_is_valid']
+        self.translation_table = snapshot['translation_table']
+        self.announced_cycles = {frozenset(cycle) for cycle in snapshot['announced_cycles']}
+        self.update_view(end_node)
+
+        # the db file isn't saved after every refresh, so the snapshot may know about later ones
+        for user_id, expires in snapshot['expires'].items():
+            if user_id in self.users:
+                self.users[user_id].expires = max(self.users[user_id].expires, expires)
+
+        return True
+
+    def spread_expiries(self, window):
+        """Reschedules overdue users over the next window seconds so they aren't all refreshed at once"""
+        now = get_current_timestamp()
+        count = 0
+        for user in self.users.values():
+            if user.disabled or not user.is_expired():
+                continue
+            user.expires = now + random.randint(0, window)
+            count += 1
+        return count
 
     def add_user(self, user_id, username):
         msg = 'Error adding user:'
@@ -75,10 +165,47 @@ class Database:
         if user_id in self.users and not self.users[user_id].disabled:
             print('disabled', self.users[user_id].str_with_id())
             self.users[user_id].disabled = True
+            self.fetch_failed.pop(user_id, None)
             return True
 
         return False
 
+    def mark_fetch_failed(self, user_id):
+        """Flags a user whose username couldn't be fetched, so reconcile_fetch_failed() rechecks them"""
+        if user_id not in self.users or self.users[user_id].disabled:
+            return
+        self.users[user_id].username_fetch_failed = True
+        if user_id not in self.fetch_failed:
+            self.fetch_failed[user_id] = [get_current_timestamp(), 0]
+
+    def reconcile_fetch_failed(self):
+        """
+        Disables flagged users as soon as they aren't in the best chain
+        Flagged users that are still in the chain are rechecked later, backing off each time
+        (their username keeps being fetched as usual, which clears the flag if it succeeds)
+        Returns the number of users that were disabled
+        """
+        now = get_current_timestamp()
+        count = 0
+        for user_id, retry in list(self.fetch_failed.items()):
+            if user_id not in self.best_chain_set:
+                # disable_user() drops the entry, but users disabled some other way need dropping here
+                self.fetch_failed.pop(user_id, None)
+                if self.disable_user(user_id):
+                    count += 1
+                continue
+
+            # still needed by the chain, so check them again later
+            retry_at, retries = retry
+            if retry_at > now:
+                continue
+
+            print('rechecking', self.users[user_id].str_with_id())
+            retry[0] = now + min(FETCH_RETRY_DELAY * 2 ** retries, FETCH_RETRY_MAX_DELAY)
+            retry[1] = retries + 1
+
+        return count
+
     def get_expired_count(self):
         count = 0
         for user_id, user in self.users.items():
@@ -120,8 +247,16 @@ class Database:
         if changes:
             self.save()
 
+        if next_user.username_fetch_failed:
+            self.mark_fetch_failed(next_id)
+        else:
+            self.fetch_failed.pop(next_id, None)
+
         for change in changes:
             for link_id in change.iter_need_update(self):
+                # users that are already waiting for a refresh don't need marking again
+                if self.users[link_id].is_expired():
+                    continue
                 print('  marked {} for updating'.format(self.users[link_id]))
                 self.users[link_id].expires = 0
 
@@ -163,30 +298,22 @@ class Database:
 
         raise RuntimeError('Couldn\'t find head in chain')
 
+    def get_joined_timestamps(self):
+        """Returns {user_id: joined timestamp} for users that have joined the chain before"""
+        return {user_id: user.joined for user_id, user in self.users.items() if user.joined}
+
     def update_best_chain(self, end_node):
         self.update_links_from_bios()
-        found_chains = self.matrix.get_chains_ending_on(end_node)
 
-        # find the best chain
-        best_index = 0
-        for index, this_chain in enumerate(found_chains):
-            if index == best_index:
-                continue
+        if PARALLEL_PROCESSES:
+            found_chains, best_index = parallel.get_chains_parallel(
+                self.matrix, end_node, self.get_joined_timestamps(), PARALLEL_PROCESSES
+            )
+        else:
+            found_chains = self.matrix.get_chains_ending_on(end_node)
 
-            this_tally = self.matrix.chain_tally(found_chains[index])
-            this_valid, this_broken = this_tally[matrix.State.REAL], this_tally[matrix.State.DEAD]
-            best_tally = self.matrix.chain_tally(found_chains[best_index])
-            best_valid, best_broken = best_tally[matrix.State.REAL], best_tally[matrix.State.DEAD]
-
-            # pick the one with the most valid links, and secondly by the least broken links
-            if this_valid > best_valid or (this_valid == best_valid and this_broken < best_broken):
-                best_index = index
-            elif this_valid == best_valid and this_broken == best_broken:
-                head1i, head2i = self.matrix.chain_get_merge_points(found_chains[best_index], this_chain)
-                head1_joined = self.users[found_chains[best_index][head1i]].joined or 0
-                head2_joined = self.users[this_chain[head2i]].joined or 0
-                if head2_joined < head1_joined:
-                    best_index = index
+            # find the best chain
+            best_index = self.matrix.get_best_chain_index(found_chains, self.get_joined_timestamps())
 
         best_chain = found_chains[best_index]
 
@@ -195,7 +322,6 @@ class Database:
 
         # Give users in the best chain a joined timestamp if they have none
         for user_id in best_chain:
-            print user_id
             if not self.users[user_id].joined:
                 self.users[user_id].joined = get_current_timestamp()
         #TODO: Uncomment and fix
@@ -205,10 +331,17 @@ class Database:
         files={'db': open(self.filename, 'rb')})
         """
         self.best_chain = best_chain
+        self.best_chain_set = set(best_chain)
         self.branches = found_chains
         self.best_chain_is_valid = self.matrix.chain_all_links_equal(best_chain)
+        self.update_view(end_node)
         return self.best_chain_is_valid
 
+    def update_view(self, end_node):
+        """Builds a new ChainView of the best chain"""
+        self.chain_version += 1
+        self.view = ChainView(self, self.chain_version, end_node)
+
     def get_branch_announcements(self):
         """Returns a list of any announcements that need to be made because branches off the best chain"""
         announcements = []
@@ -217,7 +350,7 @@ class Database:
         for branch in self.branches:
             branch_point_i, merger_i = self.matrix.chain_get_merge_points(self.best_chain, branch)
 
-            if branch[merger_i] in self.best_chain:
+            if branch[merger_i] in self.best_chain_set:
                 continue
             if self.matrix.get_link_to(branch[merger_i], branch[merger_i+1]) is matrix.State.DEAD:
                 continue
@@ -232,6 +365,26 @@ class Database:
 
         return '\n'.join(announcements)
 
+    def get_cycle_announcements(self):
+        """Returns announcements for loops of real links that haven't been announced yet"""
+        announcements = []
+
+        # loops only made possible by dead links will sort themselves out
+        is_real = lambda l: l is matrix.State.REAL
+        cycles = {frozenset(cycle): cycle for cycle in self.matrix.find_components(is_real)[1]}
+
+        for key, cycle in cycles.items():
+            if key in self.announced_cycles:
+                continue
+            announcements.append(BULLET + 'Loop detected between {}!'.format(
+                join_with_conjunction(['<code>{}</code>'.format(self.users[user_id]) for user_id in cycle])
+            ))
+
+        # forget loops that have been fixed so they're announced again if they come back
+        self.announced_cycles = set(cycles)
+
+        return '\n'.join(announcements)
+
     def stringify_chain(self, chain, length=True):
         """Converts a chain into a string"""
         non_broken = 1
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+from array import array
+
+import matrix
+
+
+# Columnar format: a directory with one file per column, so columns can be read without the rest
+# links.linker, links.linked: int64 user IDs, links.state: int8 State values
+# users.id, users.joined, users.expires: int64 (0 for no joined timestamp), users.disabled: int8
+# users.username, users.bio: one line per user, bios as space separated usernames
+COLUMNS_VERSION = 1
+STATES = {state.value: state for state in matrix.State}
+
+
+def _write_array(directory, name, typecode, values):
+    with open(os.path.join(directory, name), 'wb') as f:
+        array(typecode, values).tofile(f)
+
+
+def _read_array(directory, name, typecode, count):
+    values = array(typecode)
+    with open(os.path.join(directory, name), 'rb') as f:
+        values.fromfile(f, count)
+    return values
+
+
+def _write_lines(directory, name, lines):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+
+def _read_lines(directory, name):
+    with open(os.path.join(directory, name), encoding='utf-8') as f:
+        return [line[:-1] for line in f]
+
+
+def _read_meta(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('version') != COLUMNS_VERSION:
+        raise ValueError('Unsupported columns version: {}'.format(meta.get('version')))
+    return meta
+
+
+def _write_meta(directory, **counts):
+    path = os.path.join(directory, 'meta.json')
+    meta = {'version': COLUMNS_VERSION}
+    if os.path.exists(path):
+        meta.update(_read_meta(directory))
+    meta.update(counts)
+    with open(path, 'w') as f:
+        json.dump(meta, f)
+
+
+def iter_links(link_matrix):
+    """Yields (linker, linked, state) for every link in link_matrix"""
+    for linker in list(link_matrix.links_to):
+        for linked in link_matrix.get_links_to(linker):
+            yield linker, linked, link_matrix.get_link_to(linker, linked)
+
+
+def export_links(link_matrix, directory):
+    """Writes the links of link_matrix to directory as columns, returns the number of links"""
+    os.makedirs(directory, exist_ok=True)
+    linkers, linkeds, states = array('q'), array('q'), array('b')
+    for linker, linked, state in iter_links(link_matrix):
+        linkers.append(int(linker))
+        linkeds.append(int(linked))
+        states.append(state.value)
+
+    _write_array(directory, 'links.linker', 'q', linkers)
+    _write_array(directory, 'links.linked', 'q', linkeds)
+    _write_array(directory, 'links.state', 'b', states)
+    _write_meta(directory, links=len(states))
+    return len(states)
+
+
+def import_links(link_matrix, directory):
+    """Adds the links in a directory written by export_links() to link_matrix, returns the number of links"""
+    count = _read_meta(directory)['links']
+    linkers = _read_array(directory, 'links.linker', 'q', count)
+    linkeds = _read_array(directory, 'links.linked', 'q', count)
+    states = _read_array(directory, 'links.state', 'b', count)
+
+    set_link_to = link_matrix.set_link_to
+    for linker, linked, state in zip(linkers, linkeds, states):
+        set_link_to(str(linker), str(linked), STATES[state])
+    return count
+
+
+def export_users(users, directory):
+    """Writes {user_id: User} to directory as columns, returns the number of users"""
+    os.makedirs(directory, exist_ok=True)
+    user_list = list(users.values())
+    _write_array(directory, 'users.id', 'q', (int(user.id) for user in user_list))
+    _write_array(directory, 'users.joined', 'q', (user.joined or 0 for user in user_list))
+    _write_array(directory, 'users.expires', 'q', (user.expires for user in user_list))
+    _write_array(directory, 'users.disabled', 'b', (user.disabled for user in user_list))
+    _write_lines(directory, 'users.username', (user.username for user in user_list))
+    _write_lines(directory, 'users.bio', (' '.join(user.bio) for user in user_list))
+    _write_meta(directory, users=len(user_list))
+    return len(user_list)
+
+
+def import_users(users, directory):
+    """Adds (or replaces) the users in a directory written by export_users() to {user_id: User}"""
+    from user import User
+
+    count = _read_meta(directory)['users']
+    ids = _read_array(directory, 'users.id', 'q', count)
+    joined = _read_array(directory, 'users.joined', 'q', count)
+    expires = _read_array(directory, 'users.expires', 'q', count)
+    disabled = _read_array(directory, 'users.disabled', 'b', count)
+    usernames = _read_lines(directory, 'users.username')
+    bios = _read_lines(directory, 'users.bio')
+
+    for i in range(count):
+        users[str(ids[i])] = User(str(ids[i]), {
+            'username': usernames[i],
+            'bio': bios[i].split(),
+            'joined': joined[i] or None,
+            'expires': expires[i],
+            'disabled': bool(disabled[i]),
+        })
+    return count
+
+
+def export_edge_list(link_matrix, filename):
+    """Streams the links of link_matrix to a tab separated edge list, returns the number of links"""
+    count = 0
+    with open(filename, 'w') as f:
+        f.write('# linker\tlinked\tstate\n')
+        for linker, linked, state in iter_links(link_matrix):
+            f.write('{}\t{}\t{}\n'.format(linker, linked, state.value))
+            count += 1
+    return count
+
+
+def import_edge_list(link_matrix, filename):
+    """Streams links from an edge list written by export_edge_list() into link_matrix, returns the number of links"""
+    count = 0
+    set_link_to = link_matrix.set_link_to
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            linker, linked, state = line.split()
+            set_link_to(linker, linked, STATES[int(state)])
+            count += 1
+    return count
+
+
+def export_dot(db, best_chain, branches, filename):
+    """Writes the best chain (in bold) and its branches to a GraphViz file, dead links are dashed"""
+    edges = {}
+    for chain in [best_chain] + list(branches):
+        for i in range(1, len(chain)):
+            edges.setdefault((chain[i-1], chain[i]), chain is best_chain)
+
+    def quote(text):
+        return '"{}"'.format(str(text).replace('\\', '\\\\').replace('"', '\\"'))
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('digraph chain {\n    rankdir=LR;\n    node [shape=box];\n')
+        for user_id in dict.fromkeys(user_id for edge in edges for user_id in edge):
+            name = db.users[user_id] if user_id in db.users else user_id
+            f.write('    {} [label={}];\n'.format(quote(user_id), quote(name)))
+        for (linker, linked), in_best_chain in edges.items():
+            style = []
+            if db.matrix.get_link_to(linker, linked) is not matrix.State.REAL:
+                style.append('style=dashed')
+            if in_best_chain:
+                style.append('penwidth=2')
+            f.write('    {} -> {}{};\n'.format(
+                quote(linker), quote(linked), ' [{}]'.format(', '.join(style)) if style else ''
+            ))
+        f.write('}\n')
+    return len(edges)
+
+
+def benchmark(size, directory):
+    """Times exporting and importing a synthetic group of `size` users in both formats"""
+    import synthetic
+
+    link_matrix = synthetic.make_matrix(size)
+    edge_list = os.path.join(directory, 'links.tsv')
+    steps = (
+        ('export columns', lambda: export_links(link_matrix, directory)),
+        ('import columns', lambda: import_links(matrix.LinkMatrix(), directory)),
+        ('export edge list', lambda: export_edge_list(link_matrix, edge_list)),
+        ('import edge list', lambda: import_edge_list(matrix.LinkMatrix(), edge_list)),
+    )
+    for name, step in steps:
+        start = time.perf_counter()
+        count = step()
+        print('{:>16}: {} links in {:.2f}s'.format(name, count, time.perf_counter() - start))
+
+    imported = matrix.LinkMatrix()
+    import_links(imported, directory)
+    assert sorted(iter_links(imported)) == sorted(iter_links(link_matrix))
+
+
+USAGE = '''usage:
+    python graph_io.py export <db file> <directory>      write users and links as columns
+    python graph_io.py import <directory> <db file>      add users and links from columns to a db
+    python graph_io.py edges <db file> <edge list>       write links as a tab separated edge list
+    python graph_io.py dot <db file> <end node> <file>   write the best chain and branches for GraphViz
+    python graph_io.py bench [size] [directory]          time a synthetic group (100000 users by default)'''
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    command = args.pop(0) if args else None
+
+    if command == 'bench':
+        import tempfile
+        size = int(args[0]) if args else 100000
+        benchmark(size, args[1] if args[1:] else tempfile.mkdtemp())
+    elif command in ('export', 'import', 'edges', 'dot') and len(args) >= 2:
+        from database import Database
+
+        if command == 'export':
+            db = Database(args[0])
+            print('Exported {} users'.format(export_users(db.users, args[1])))
+            print('Exported {} links'.format(export_links(db.matrix, args[1])))
+        elif command == 'import':
+            db = Database(args[1])
+            print('Imported {} users'.format(import_users(db.users, args[0])))
+            print('Imported {} links'.format(import_links(db.matrix, args[0])))
+            db.save()
+        elif command == 'edges':
+            db = Database(args[0])
+            print('Exported {} links'.format(export_edge_list(db.matrix, args[1])))
+        elif command == 'dot' and len(args) >= 3:
+            db = Database(args[0])
+            chains = db.matrix.get_chains_ending_on(args[1])
+            best_chain = chains.pop(db.matrix.get_best_chain_index(chains, db.get_joined_timestamps()))
+            print('Exported {} links'.format(export_dot(db, best_chain, chains, args[2])))
+        else:
+            print(USAGE)
+    else:
+        print(USAGE)
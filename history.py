@@ -0,0 +1,215 @@
+import os
+import mmap
+import struct
+import time
+from contextlib import contextmanager
+
+from util import *
+
+
+# timestamp, data offset, length, valid length, head, number of users added, number of users removed
+INDEX_ENTRY = struct.Struct('<qQIIqII')
+USER_ID = struct.Struct('<q')
+
+
+class ChainHistory:
+    """
+    Append-only history of the best chain, stored as deltas between versions
+    filename.idx holds a fixed size entry per version (so it can be binary searched by time),
+    and filename.dat holds the IDs of the users added and removed by each version
+    Queries read the files through mmap, only the current membership is kept in memory
+    """
+    def __init__(self, filename):
+        self.index_filename = filename + '.idx'
+        self.data_filename = filename + '.dat'
+
+        for path in (self.index_filename, self.data_filename):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+
+        # state of the latest version, rebuilt by replaying the deltas
+        self.members = set()
+        self.head = None
+        self.length = 0
+        self.valid_length = 0
+        with self.__map(self.index_filename) as index, self.__map(self.data_filename) as data:
+            for i in range(self.__count(index)):
+                self.__apply(index, data, i, self.members)
+                timestamp, offset, self.length, self.valid_length, self.head, added, removed = \
+                    INDEX_ENTRY.unpack_from(index, i * INDEX_ENTRY.size)
+
+    @contextmanager
+    def __map(self, filename):
+        """Yields a read-only mmap of the file (or empty bytes if the file is empty)"""
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def __count(self, index):
+        return len(index) // INDEX_ENTRY.size
+
+    def __apply(self, index, data, i, members):
+        """Applies the delta of version i to the set members"""
+        timestamp, offset, length, valid_length, head, added, removed = \
+            INDEX_ENTRY.unpack_from(index, i * INDEX_ENTRY.size)
+        ids = struct.unpack_from('<{}q'.format(added + removed), data, offset)
+        members.update(ids[:added])
+        members.difference_update(ids[added:])
+
+    def __len__(self):
+        return os.path.getsize(self.index_filename) // INDEX_ENTRY.size
+
+    def record(self, chain, valid_length, head_id, timestamp=None):
+        """Appends a version of the chain, returns False if nothing about it has changed"""
+        members = {int(user_id) for user_id in chain}
+        added = members - self.members
+        removed = self.members - members
+        head = int(head_id)
+        if not added and not removed and head == self.head \
+                and len(chain) == self.length and valid_length == self.valid_length:
+            return False
+
+        if timestamp is None:
+            timestamp = get_current_timestamp()
+
+        ids = sorted(added) + sorted(removed)
+        offset = os.path.getsize(self.data_filename)
+        with open(self.data_filename, 'ab') as f:
+            f.write(struct.pack('<{}q'.format(len(ids)), *ids))
+        # the index is written last so that it never points at missing data
+        with open(self.index_filename, 'ab') as f:
+            f.write(INDEX_ENTRY.pack(
+                timestamp,
+                offset,
+                len(chain),
+                valid_length,
+                head,
+                len(added),
+                len(removed)
+            ))
+
+        self.members = members
+        self.head = head
+        self.length = len(chain)
+        self.valid_length = valid_length
+        return True
+
+    def __bisect(self, index, timestamp):
+        """Returns the index of the first version recorded at or after timestamp"""
+        low, high = 0, self.__count(index)
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX_ENTRY.unpack_from(index, middle * INDEX_ENTRY.size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lengths_between(self, start, end=None):
+        """Returns a list of (timestamp, length, valid length, head ID) for versions recorded in [start, end)"""
+        results = []
+        with self.__map(self.index_filename) as index:
+            last = self.__bisect(index, end) if end is not None else self.__count(index)
+            for i in range(self.__bisect(index, start), last):
+                timestamp, offset, length, valid_length, head, added, removed = \
+                    INDEX_ENTRY.unpack_from(index, i * INDEX_ENTRY.size)
+                results.append((timestamp, length, valid_length, str(head)))
+        return results
+
+    def lengths_since(self, seconds):
+        """Same as lengths_between() for the last `seconds` seconds"""
+        return self.lengths_between(get_current_timestamp() - seconds)
+
+    def __find_version(self, index, offset):
+        """Returns the index of the version whose data contains offset"""
+        low, high = 0, self.__count(index) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if INDEX_ENTRY.unpack_from(index, middle * INDEX_ENTRY.size)[1] <= offset:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def first_joined(self, user_id):
+        """Returns the timestamp of the first version that user_id was in, or None"""
+        pattern = USER_ID.pack(int(user_id))
+        with self.__map(self.index_filename) as index, self.__map(self.data_filename) as data:
+            position = data.find(pattern)
+            while position != -1:
+                # every ID is 8 bytes, so a real match is always aligned
+                if position % USER_ID.size == 0:
+                    i = self.__find_version(index, position)
+                    timestamp, offset, length, valid_length, head, added, removed = \
+                        INDEX_ENTRY.unpack_from(index, i * INDEX_ENTRY.size)
+                    if position < offset + added * USER_ID.size:
+                        return timestamp
+                position = data.find(pattern, position + 1)
+        return None
+
+    def members_at(self, timestamp):
+        """Returns the set of user IDs that were in the chain at timestamp"""
+        members = set()
+        with self.__map(self.index_filename) as index, self.__map(self.data_filename) as data:
+            for i in range(self.__bisect(index, timestamp + 1)):
+                self.__apply(index, data, i, members)
+        return {str(user_id) for user_id in members}
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'history')
+
+    history = ChainHistory(filename)
+    assert history.record(['1', '2', '3'], 3, '1', timestamp=100)
+    assert not history.record(['1', '2', '3'], 3, '1', timestamp=110)
+    assert history.record(['4', '1', '2', '3'], 2, '4', timestamp=200)
+    assert history.record(['4', '2', '3'], 3, '4', timestamp=300)
+    assert len(history) == 3
+
+    # reopening replays the deltas
+    history = ChainHistory(filename)
+    assert history.members == {4, 2, 3} and history.head == 4
+    assert not history.record(['4', '2', '3'], 3, '4', timestamp=400)
+
+    assert history.lengths_between(150) == [(200, 4, 2, '4'), (300, 3, 3, '4')]
+    assert history.lengths_between(0, 300) == [(100, 3, 3, '1'), (200, 4, 2, '4')]
+    assert history.first_joined('4') == 200
+    assert history.first_joined('2') == 100
+    assert history.first_joined('5') is None
+    assert history.members_at(250) == {'1', '2', '3', '4'}
+    assert history.members_at(50) == set()
+
+    # a bigger history, to time the queries
+    filename = os.path.join(directory, 'big')
+    history = ChainHistory(filename)
+    chain = [str(i) for i in range(1000)]
+    start = time.perf_counter()
+    for version in range(10000):
+        chain[version % 1000] = str(1000 + version)
+        history.record(chain, len(chain), chain[0], timestamp=version * 60)
+    print('recorded {} versions in {:.2f}s, {} bytes'.format(
+        len(history),
+        time.perf_counter() - start,
+        os.path.getsize(filename + '.idx') + os.path.getsize(filename + '.dat')
+    ))
+
+    start = time.perf_counter()
+    everything = history.lengths_between(0)
+    last_day = history.lengths_between(9000 * 60 - 24 * 60 * 60, 9000 * 60)
+    joined = history.first_joined('10500')
+    print('queried {} versions, {} in a day, joined at {} in {:.2f}ms'.format(
+        len(everything), len(last_day), joined, (time.perf_counter() - start) * 1000
+    ))
+
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
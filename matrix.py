@@ -1,4 +1,5 @@
 from enum import Enum
+from types import MappingProxyType
 
 from collections import defaultdict
 
@@ -15,12 +16,24 @@ class State(Enum):
     REAL = 1
 
 
+# what missing rows are read as, so that reads don't add rows or build a new dict every time
+NO_LINKS = MappingProxyType({})
+# chains longer than this are worth finding the components for, see get_chains_ending_on()
+SHORT_CHAIN_LENGTH = 32
+
+
 class LinkMatrix:
     """Wrapper for two matricies that represent forward and backwards connections in a graph"""
     def __init__(self):
         self.links_to = self.__new_empty()
         self.links_from = self.__new_empty()
 
+        # storage for update_components()
+        self.components = {}
+        self.cycles = []
+        # True when links have been added or removed since update_components() last ran
+        self.components_stale = False
+
     def __new_empty(self):
         return defaultdict(
             lambda: defaultdict(
@@ -28,6 +41,15 @@ class LinkMatrix:
             )
         )
 
+    def copy(self):
+        """Returns a new LinkMatrix with the same links, found by get_links_from() in the same order"""
+        new_matrix = LinkMatrix()
+        for linked, linkers in self.links_from.items():
+            for linker, state in linkers.items():
+                if state is not State.NONE:
+                    new_matrix.set_link_from(linked, linker, state)
+        return new_matrix
+
     def replace(self, state, new_state):
         count = 0
         for linker in self.links_to:
@@ -38,57 +60,153 @@ class LinkMatrix:
         return count
 
     def set_link_to(self, linker, linked, state):
+        if (state is State.NONE) is not (self.get_link_to(linker, linked) is State.NONE):
+            self.components_stale = True
         self.links_to[linker][linked] = state
         self.links_from[linked][linker] = state
 
     def set_link_from(self, linked, linker, state):
+        if (state is State.NONE) is not (self.get_link_from(linked, linker) is State.NONE):
+            self.components_stale = True
         self.links_from[linked][linker] = state
         self.links_to[linker][linked] = state
 
+    # reads use .get() so that looking up a missing link doesn't add it to the matrix
     def get_link_to(self, linker, linked):
-        return self.links_to[linker][linked]
+        return self.links_to.get(linker, NO_LINKS).get(linked, State.NONE)
 
     def get_link_from(self, linked, linker):
-        return self.links_from[linked][linker]
+        return self.links_from.get(linked, NO_LINKS).get(linker, State.NONE)
 
     def get_links_to(self, linker, filter=lambda l: l is not State.NONE):
         """yields nodes that the linker links to that match filter"""
-        for linked in self.links_to[linker]:
-            if filter(self.links_to[linker][linked]):
+        for linked, state in self.links_to.get(linker, NO_LINKS).items():
+            if filter(state):
                 yield linked
 
     def get_links_from(self, linked, filter=lambda l: l is not State.NONE):
         """yields nodes that linked is linked from that match filter"""
-        for linker in self.links_from[linked]:
-            if filter(self.links_from[linked][linker]):
+        for linker, state in self.links_from.get(linked, NO_LINKS).items():
+            if filter(state):
                 yield linker
 
+    def get_nodes(self):
+        """Returns a set of every node that links or is linked to"""
+        return set(self.links_to) | set(self.links_from)
 
     def has_link_like(self, linker, state=State.REAL):
         """Returns True if linker has a link that is the same as state"""
-        for linked in self.links_to[linker]:
-            if self.links_to[linker][linked] is state:
-                return True
+        for linked in self.get_links_to(linker, lambda l: l is state):
+            return True
         return False
 
-    def get_chains_ending_on(self, end_node):
+    def update_components(self):
+        """
+        Finds the strongly connected components of the graph
+        self.components maps each node to the index of its component
+        self.cycles is a list of the components that contain a loop, as sorted lists of nodes
+        """
+        self.components, self.cycles = self.find_components()
+        self.components_stale = False
+        return self.cycles
+
+    def get_components(self):
+        """Returns self.components, running update_components() first if links have been added or removed since"""
+        if self.components_stale:
+            self.update_components()
+        return self.components
+
+    def find_components(self, filter=lambda l: l is not State.NONE):
+        """
+        Finds the strongly connected components of the graph made of the links that match filter
+        (Tarjan's algorithm, iterative)
+        Returns ({node: index of its component}, [components that contain a loop, as sorted lists of nodes])
+        """
+        nodes = self.get_nodes()
+        index_of = {}
+        lowlink = {}
+        on_stack = set()
+        stack = []
+        components = {}
+        cycles = []
+        next_index = 0
+        component_count = 0
+
+        for root in nodes:
+            if root in index_of:
+                continue
+
+            index_of[root] = lowlink[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, self.get_links_from(root, filter))]
+
+            while work:
+                node, linkers = work[-1]
+                for linker in linkers:
+                    if linker not in index_of:
+                        index_of[linker] = lowlink[linker] = next_index
+                        next_index += 1
+                        stack.append(linker)
+                        on_stack.add(linker)
+                        work.append((linker, self.get_links_from(linker, filter)))
+                        break
+                    if linker in on_stack:
+                        lowlink[node] = min(lowlink[node], index_of[linker])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                    if lowlink[node] != index_of[node]:
+                        continue
+
+                    # node is the root of a component, pop it off the stack
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        components[member] = component_count
+                        component.append(member)
+                        if member == node:
+                            break
+                    component_count += 1
+
+                    if len(component) > 1 or filter(self.get_link_from(node, node)):
+                        cycles.append(sorted(component))
+
+        return components, cycles
+
+    def get_chains_ending_on(self, end_node, via=None):
         """
         Returns a list of chains (if any) that end on end_node
+        via: only find the chains whose last link is via -> end_node
         """
         found_chains = []
 
-        pending_chains = [[end_node]]
+        # a chain can only revisit a node through a loop, so nodes that aren't part of
+        # the same component as the last link never need to be looked up in the chain.
+        # Looking through short chains is cheaper than finding the components though, so if they're
+        # out of date they're only found once a chain gets long (until then every node is looked up)
+        components = NO_LINKS if self.components_stale else self.get_components()
+
+        pending_chains = [[end_node, via]] if via is not None else [[end_node]]
 
         while pending_chains:
             # grab a chain from the stack
             this_chain = pending_chains.pop()
             last_link = this_chain[-1]
+            if components is NO_LINKS and len(this_chain) > SHORT_CHAIN_LENGTH:
+                components = self.get_components()
+            last_component = components.get(last_link)
             is_end = True
 
             # iterate through all the links lead to here
             for next_link in self.get_links_from(last_link):
                 # skip link if we have visited it before
-                if next_link in this_chain:
+                if components.get(next_link) == last_component and next_link in this_chain:
                     continue
 
                 # since we can reach a node then this is not the end
@@ -104,21 +222,31 @@ class LinkMatrix:
 
         return found_chains
 
+    # the scoring methods read links_to directly, LinkOverlay reads through get_link_to() instead
     def chain_all_links_equal(self, chain, state=State.REAL):
         """Returns true if all links in chain are equal to state"""
-        for i in range(1, len(chain)):
-            this_node, next_node = chain[i-1], chain[i]
-            if self.links_to[this_node][next_node] is not state:
-                return False
+        get = self.links_to.get
+        return all(
+            get(this_node, NO_LINKS).get(next_node, State.NONE) is state
+            for this_node, next_node in zip(chain, chain[1:])
+        )
 
-        return True
+    def chain_states(self, chain):
+        """Returns the state of each link in chain"""
+        get = self.links_to.get
+        return [
+            get(this_node, NO_LINKS).get(next_node, State.NONE)
+            for this_node, next_node in zip(chain, chain[1:])
+        ]
 
     def chain_tally(self, chain):
-        count = defaultdict(int)
+        states = self.chain_states(chain)
 
-        for i in range(1, len(chain)):
-            this_node, next_node = chain[i-1], chain[i]
-            count[self.links_to[this_node][next_node]] += 1
+        count = defaultdict(int)
+        for state in (State.REAL, State.DEAD, State.NONE):
+            state_count = states.count(state)
+            if state_count:
+                count[state] = state_count
 
         return count
 
@@ -133,6 +261,115 @@ class LinkMatrix:
 
         return i1, i2
 
+    def chain_valid_length(self, chain):
+        """Returns how many nodes at the end of chain are joined by real links"""
+        valid_length = 1
+        for i in range(len(chain)-1, 0, -1):
+            if self.get_link_to(chain[i-1], chain[i]) is not State.REAL:
+                break
+            valid_length += 1
+        return valid_length
+
+    def get_best_chain_index(self, chains, joined):
+        """
+        Returns the index of the best chain in chains:
+        the one with the most real links, then the least dead links, and then the one whose
+        merge point with the best so far has the earliest joined timestamp ({node: timestamp})
+        """
+        best_index = 0
+        best_valid, best_broken = 0, 0
+        for index, this_chain in enumerate(chains):
+            states = self.chain_states(this_chain)
+            this_valid, this_broken = states.count(State.REAL), states.count(State.DEAD)
+            if index == best_index:
+                best_valid, best_broken = this_valid, this_broken
+                continue
+
+            # pick the one with the most valid links, and secondly by the least broken links
+            if this_valid > best_valid or (this_valid == best_valid and this_broken < best_broken):
+                best_index = index
+                best_valid, best_broken = this_valid, this_broken
+            elif this_valid == best_valid and this_broken == best_broken:
+                head1i, head2i = self.chain_get_merge_points(chains[best_index], this_chain)
+                head1_joined = joined.get(chains[best_index][head1i]) or 0
+                head2_joined = joined.get(this_chain[head2i]) or 0
+                if head2_joined < head1_joined:
+                    best_index = index
+
+        return best_index
+
+
+class LinkOverlay(LinkMatrix):
+    """
+    Copy-on-write view of a LinkMatrix
+    Links set on the overlay hide the base matrix's links, but the base matrix is never changed
+    """
+    def __init__(self, base):
+        self.base = base
+        self.links_to = defaultdict(dict)
+        self.links_from = defaultdict(dict)
+        # None until update_components() is run on the overlay itself, the base's are used until then
+        self.components = None
+        self.cycles = []
+        self.components_stale = False
+
+    def replace(self, state, new_state):
+        """Overrides every link (in the base matrix or the overlay) that is state with new_state"""
+        count = 0
+        for linker in self.get_nodes():
+            for linked in list(self.get_links_to(linker, lambda l: l is state)):
+                self.set_link_to(linker, linked, new_state)
+                count += 1
+        return count
+
+    def get_link_to(self, linker, linked):
+        overrides = self.links_to.get(linker)
+        if overrides and linked in overrides:
+            return overrides[linked]
+        return self.base.get_link_to(linker, linked)
+
+    def get_link_from(self, linked, linker):
+        return self.get_link_to(linker, linked)
+
+    def chain_all_links_equal(self, chain, state=State.REAL):
+        for i in range(1, len(chain)):
+            if self.get_link_to(chain[i-1], chain[i]) is not state:
+                return False
+        return True
+
+    def chain_states(self, chain):
+        return [self.get_link_to(chain[i-1], chain[i]) for i in range(1, len(chain))]
+
+    def get_links_to(self, linker, filter=lambda l: l is not State.NONE):
+        overrides = self.links_to.get(linker, NO_LINKS)
+        for linked in self.base.get_links_to(linker, lambda l: True):
+            if linked not in overrides and filter(self.base.get_link_to(linker, linked)):
+                yield linked
+        for linked, state in overrides.items():
+            if filter(state):
+                yield linked
+
+    def get_links_from(self, linked, filter=lambda l: l is not State.NONE):
+        overrides = self.links_from.get(linked, NO_LINKS)
+        for linker in self.base.get_links_from(linked, lambda l: True):
+            if linker not in overrides and filter(self.base.get_link_from(linked, linker)):
+                yield linker
+        for linker, state in overrides.items():
+            if filter(state):
+                yield linker
+
+    def get_nodes(self):
+        return self.base.get_nodes() | set(self.links_to) | set(self.links_from)
+
+    def get_components(self):
+        # finding components costs about as much as the chain search itself, so once links are added or
+        # removed the overlay checks every step against the whole chain instead of finding its own
+        if self.components_stale:
+            return {}
+        if self.components is None:
+            return self.base.get_components()
+        return self.components
+
 
 if __name__ == '__main__':
     matrix = LinkMatrix()
@@ -154,3 +391,40 @@ if __name__ == '__main__':
     print(matrix.chain_get_merge_points(chains[0], chains[1]))
 
     print(matrix.chain_tally(chains[0]))
+
+    matrix.set_link_to('D', 'A', State.REAL)
+    matrix.set_link_to('E', 'F', State.REAL)
+    matrix.set_link_to('F', 'E', State.DEAD)
+    # A -> B -> C -> D -> A, E <-> F
+    chains = matrix.get_chains_ending_on('D')
+    # these chains are all short, so the components weren't worth finding
+    assert matrix.components_stale
+    matrix.update_components()
+    assert sorted(matrix.cycles) == [['A', 'B', 'C', 'D'], ['E', 'F']]
+    assert ['Q', 'D'] in chains
+    assert sorted(matrix.find_components(lambda l: l is State.REAL)[1]) == [['A', 'B', 'C', 'D']]
+
+    # components only need finding again when links are added or removed
+    assert not matrix.components_stale
+    matrix.set_link_to('Q', 'D', State.DEAD)
+    matrix.set_link_to('Q', 'D', State.REAL)
+    assert not matrix.components_stale
+    print(chains)
+
+    # changes on an overlay don't touch the matrix underneath
+    overlay = LinkOverlay(matrix)
+    overlay.set_link_to('Q', 'D', State.NONE)
+    overlay.set_link_to('Q', 'A', State.REAL)
+    assert matrix.get_link_to('Q', 'D') is State.REAL
+    assert overlay.get_link_to('Q', 'D') is State.NONE
+    assert overlay.components_stale and overlay.get_components() == {}
+    assert ['Q', 'A', 'B', 'C', 'D'] in overlay.get_chains_ending_on('D')
+    assert ['Q', 'D'] in matrix.get_chains_ending_on('D')
+
+    assert overlay.replace(State.DEAD, State.REAL) == 1
+    assert overlay.get_link_to('F', 'E') is State.REAL and matrix.get_link_to('F', 'E') is State.DEAD
+    assert overlay.replace(State.REAL, State.DEAD) == 8
+    assert not overlay.has_link_like('A') and matrix.has_link_like('A')
+
+    copy = matrix.copy()
+    assert copy.links_from == {linked: linkers for linked, linkers in matrix.links_from.items() if linkers}
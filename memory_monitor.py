@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import tracemalloc
+
+
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def format_size(size):
+    return '{:+.1f} KiB'.format(size / 1024)
+
+
+def get_rss():
+    """Returns the resident set size of this process in bytes, or None if it can't be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_object_counts(db):
+    """Counts the things in db that grow over time"""
+    return {
+        'users': len(db.users),
+        'link cells': sum(len(links) for links in db.matrix.links_to.values())
+                      + sum(len(links) for links in db.matrix.links_from.values()),
+        'chains': (1 if db.best_chain else 0) + len(db.branches),
+        'chain nodes': len(db.best_chain) + sum(len(branch) for branch in db.branches),
+        'cached answers': len(db.view.cache) if db.view else 0,
+    }
+
+
+class MemoryMonitor:
+    """
+    Watches the process's RSS and the database's object counts, which are cheap to read
+    Tracing every allocation slows everything down several times over, so tracemalloc only runs for
+    `window` seconds out of every `interval`. When a window ends, the allocations made during it that
+    are still alive are reported along with the RSS and counts
+    check() returns the report whenever RSS has grown by `threshold` bytes since the last alarm
+    """
+    def __init__(self, interval, window, threshold, top=8, frames=1):
+        self.interval = interval
+        self.window = window
+        self.threshold = threshold
+        self.top = top
+        self.frames = frames
+
+        self.start_rss = get_rss()
+        self.alarm_rss = self.start_rss
+        self.last_rss = self.start_rss
+        self.last_time = time.monotonic()
+        self.last_counts = {}
+
+        # when the current sampling window started and ends, None if there isn't one
+        self.window_start = None
+        self.window_end = None
+        self.started_tracing = False
+
+    def __format_stats(self, stats, key):
+        lines = []
+        for stat in stats[:self.top]:
+            frame = stat.traceback[0]
+            where = os.path.basename(frame.filename)
+            if key == 'lineno':
+                where += ':{}'.format(frame.lineno)
+            lines.append('  {} {} ({:+} blocks)'.format(format_size(stat.size), where, stat.count))
+        return lines
+
+    def __start_window(self, now):
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(self.frames)
+        self.window_start = now
+        self.window_end = now + self.window
+
+    def __end_window(self, db, now):
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        if self.started_tracing:
+            tracemalloc.stop()
+        self.window_end = None
+
+        rss = get_rss()
+        counts = get_object_counts(db)
+
+        if rss is None:
+            lines = ['Memory: RSS unavailable']
+        else:
+            lines = ['Memory: {:.1f} MiB RSS, {} since last check, {} since start'.format(
+                rss / 1024 / 1024,
+                format_size(rss - self.last_rss),
+                format_size(rss - self.start_rss)
+            )]
+        lines.append('Objects: ' + ', '.join(
+            '{} {} ({:+})'.format(count, name, count - self.last_counts.get(name, count))
+            for name, count in counts.items()
+        ))
+        lines.append('Allocated in the last {:.0f}s and still alive, top modules:'.format(now - self.window_start))
+        lines.extend(self.__format_stats(snapshot.statistics('filename'), 'filename'))
+        lines.append('Top lines:')
+        lines.extend(self.__format_stats(snapshot.statistics('lineno'), 'lineno'))
+        report = '\n'.join(lines)
+        print(report)
+
+        self.last_rss = rss
+        self.last_time = now
+        self.last_counts = counts
+
+        if rss is None:
+            return None
+        growth = rss - self.alarm_rss
+        if growth < self.threshold:
+            return None
+        self.alarm_rss = rss
+        return 'Memory has grown by {} since the last warning\n\n{}'.format(format_size(growth), report)
+
+    def check(self, db, force=False):
+        """
+        Starts a sampling window every `interval` seconds, and reports on it when it ends
+        force starts a window now (or ends the current one)
+        Returns the report if memory has grown past the alarm threshold, otherwise None
+        """
+        now = time.monotonic()
+        if self.window_end is not None:
+            if force or now >= self.window_end:
+                return self.__end_window(db, now)
+        elif force or now - self.last_time >= self.interval:
+            self.__start_window(now)
+        return None
+
+
+def benchmark(size):
+    """Times the chain engine on a synthetic group with and without tracing, returns (untraced, traced) seconds"""
+    import synthetic
+
+    link_matrix = synthetic.make_matrix(size)
+    joined = synthetic.make_joined(size)
+
+    def run():
+        start = time.perf_counter()
+        chains = link_matrix.get_chains_ending_on('0')
+        link_matrix.get_best_chain_index(chains, joined)
+        return time.perf_counter() - start
+
+    untraced = min(run() for i in range(3))
+    tracemalloc.start(1)
+    traced = min(run() for i in range(3))
+    tracemalloc.stop()
+    return untraced, traced
+
+
+if __name__ == '__main__':
+    import matrix
+    from util import MEMORY_SNAPSHOT_INTERVAL, MEMORY_SAMPLE_SECONDS
+
+    class FakeDatabase:
+        def __init__(self):
+            self.users = {}
+            self.matrix = matrix.LinkMatrix()
+            self.best_chain = []
+            self.branches = []
+            self.view = None
+
+    db = FakeDatabase()
+    monitor = MemoryMonitor(interval=3600, window=60, threshold=8 * 1024 * 1024)
+    assert not tracemalloc.is_tracing()
+    assert monitor.check(db) is None and not tracemalloc.is_tracing()
+
+    assert monitor.check(db, force=True) is None and tracemalloc.is_tracing()
+    leak = []
+    for i in range(20000):
+        db.matrix.set_link_to(str(i), str(i + 1), matrix.State.REAL)
+    for i in range(200000):
+        leak.append('x' * 100)
+    assert monitor.check(db) is None and tracemalloc.is_tracing()
+    report = monitor.check(db, force=True)
+    assert report and 'link cells' in report and 'memory_monitor.py' in report
+    assert not tracemalloc.is_tracing()
+
+    # usage: python memory_monitor.py [size]
+    size = int(sys.argv[1]) if sys.argv[1:] else 3000
+    untraced, traced = benchmark(size)
+    duty = MEMORY_SAMPLE_SECONDS / MEMORY_SNAPSHOT_INTERVAL
+    print('{} users: {:.3f}s untraced, {:.3f}s traced ({:.1f}x)'.format(size, untraced, traced, traced / untraced))
+    print('tracing {:.0f}s out of every {:.0f}s adds {:.1%} on average'.format(
+        MEMORY_SAMPLE_SECONDS, MEMORY_SNAPSHOT_INTERVAL, (traced / untraced - 1) * duty
+    ))
@@ -0,0 +1,136 @@
+import multiprocessing
+import sys
+import time
+
+import matrix
+
+
+# the matrix and joined timestamps of a worker process, set up by _init_worker()
+_matrix = None
+_joined = None
+
+
+def _init_worker(links, joined):
+    global _matrix, _joined
+    _matrix = matrix.LinkMatrix()
+    for linked, linker, state in links:
+        _matrix.set_link_to(linker, linked, matrix.State(state))
+    _matrix.update_components()
+    _joined = joined
+
+
+def _pack_chains(chains):
+    """
+    Packs chains that share their ends into a tree: (nodes, parents, ends)
+    nodes[i] is a node, parents[i] the index of the node after it (-1 for the last node),
+    and ends has the index of the first node of each chain
+    """
+    nodes, parents, ends = [], [], []
+    index = {}
+    for chain in chains:
+        parent = -1
+        for node in reversed(chain):
+            key = (parent, node)
+            if key not in index:
+                index[key] = len(nodes)
+                nodes.append(node)
+                parents.append(parent)
+            parent = index[key]
+        ends.append(parent)
+    return nodes, parents, ends
+
+
+def _unpack_chains(nodes, parents, ends):
+    """Turns the tree made by _pack_chains() back into a list of chains"""
+    chains = []
+    for i in ends:
+        chain = []
+        while i != -1:
+            chain.append(nodes[i])
+            i = parents[i]
+        chains.append(chain)
+    return chains
+
+
+def _score_subtree(task):
+    """Finds every chain that ends with via -> end_node, returns them packed with the index of the best one"""
+    end_node, via = task
+    chains = _matrix.get_chains_ending_on(end_node, via=via)
+    return _pack_chains(chains), _matrix.get_best_chain_index(chains, _joined)
+
+
+def _get_context():
+    # forking copies the parent's threads' locks in whatever state they're in, and the bot runs
+    # the telegram updater's threads, so workers are started from a clean process instead
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['parallel'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def get_chains_parallel(link_matrix, end_node, joined, processes=None):
+    """
+    Returns the same (chains, best index) as link_matrix.get_chains_ending_on(end_node) and
+    link_matrix.get_best_chain_index(), but the chains are found and scored in a process pool,
+    one task per user that links to end_node
+
+    get_chains_ending_on() finds every chain through the last user that links to end_node before
+    moving on to the one before it, so the subtrees' chains are put back together in that order.
+    For chains from different subtrees the tie-break only compares those users' joined timestamps,
+    so picking the best of each subtree's best chain, in that same order, always picks the same
+    chain as scoring everything serially
+    """
+    vias = [linker for linker in link_matrix.get_links_from(end_node) if linker != end_node]
+    if not vias:
+        return [[end_node]], 0
+
+    # links_from is sent in its own order so that workers find chains in the same order
+    links = [
+        (linked, linker, state.value)
+        for linked, linkers in link_matrix.links_from.items()
+        for linker, state in linkers.items()
+        if state is not matrix.State.NONE
+    ]
+    tasks = [(end_node, via) for via in reversed(vias)]
+
+    with _get_context().Pool(processes, _init_worker, (links, joined)) as pool:
+        scored = pool.map(_score_subtree, tasks, chunksize=1)
+
+    chains = []
+    best_indexes = []
+    for packed, best_index in scored:
+        best_indexes.append(len(chains) + best_index)
+        chains.extend(_unpack_chains(*packed))
+
+    best_chains = [chains[index] for index in best_indexes]
+    return chains, best_indexes[link_matrix.get_best_chain_index(best_chains, joined)]
+
+
+if __name__ == '__main__':
+    import synthetic
+
+    # usage: python parallel.py [size] [processes]
+    size = int(sys.argv[1]) if sys.argv[1:] else 20000
+    processes = int(sys.argv[2]) if sys.argv[2:] else None
+
+    link_matrix = synthetic.make_matrix(size, strands=16, extra_links=0.03)
+    joined = synthetic.make_joined(size)
+
+    start = time.perf_counter()
+    chains = link_matrix.get_chains_ending_on('0')
+    serial_chain = chains[link_matrix.get_best_chain_index(chains, joined)]
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel_chains, best_index = get_chains_parallel(link_matrix, '0', joined, processes)
+    parallel_time = time.perf_counter() - start
+
+    assert parallel_chains[best_index] == serial_chain
+    assert parallel_chains == chains
+    print('{} users, {} chains in {} subtrees, best chain {} long'.format(
+        size, len(chains), len(list(link_matrix.get_links_from('0'))), len(serial_chain)
+    ))
+    print('serial: {:.2f}s, parallel ({} processes): {:.2f}s, {:.1f}x'.format(
+        serial_time, processes or multiprocessing.cpu_count(), parallel_time, serial_time / parallel_time
+    ))
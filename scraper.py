@@ -0,0 +1,199 @@
+import asyncio
+import sys
+import time
+import httpx
+
+from bio_parser import BioExtractor
+from util import *
+
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ScrapeResult:
+    """The result of scraping a single profile page"""
+    def __init__(self, username, status=None, bio=None, usernames=None, latency=0, attempts=1, error=None):
+        self.username = username
+        self.status = status
+        self.bio = bio
+        self.usernames = usernames or []
+        self.latency = latency
+        self.attempts = attempts
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.status is not None and self.status < 400
+
+    def __str__(self):
+        return '@{}: {} in {:.0f}ms ({} attempt{}){}'.format(
+            self.username,
+            self.status,
+            self.latency * 1000,
+            self.attempts,
+            's' if self.attempts > 1 else '',
+            ' ' + self.error if self.error else ''
+        )
+
+
+class BioScraper:
+    """
+    Scrapes bios from t.me profile pages over a pool of persistent connections
+    HTTP/2 is used if the h2 package is installed, so that concurrent requests share one connection
+    """
+    def __init__(self, timeout=SCRAPE_TIMEOUT, retries=SCRAPE_RETRIES, concurrency=SCRAPE_CONCURRENCY):
+        self.timeout = timeout
+        self.retries = retries
+        self.concurrency = concurrency
+        self.client = None
+        self.semaphore = None
+        # the loop that the blocking wrappers run on, kept so that connections can be reused
+        self.loop = None
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=SCRAPE_BASE_URL,
+                http2=HTTP2_AVAILABLE,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency
+                ),
+                follow_redirects=True
+            )
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.client
+
+    async def _get(self, username):
+        """
+        Streams the profile page, only parsing it until the bio has been found
+        Closing an HTTP/1.1 response early closes its connection too, so over HTTP/1.1 the rest of
+        the page is still read (without parsing it) to keep the connection in the pool
+        """
+        extractor = BioExtractor()
+        async with self._get_client().stream('GET', username) as response:
+            if response.status_code < 400:
+                found = False
+                async for chunk in response.aiter_text():
+                    if found:
+                        continue
+                    found = extractor.feed(chunk)
+                    if found and response.http_version == 'HTTP/2':
+                        break
+            else:
+                await response.aread()
+        return response.status_code, extractor
+
+    async def fetch(self, username):
+        """Scrapes a single username, retrying on timeouts, connection errors and server errors"""
+        self._get_client()
+        result = ScrapeResult(username)
+        start = time.perf_counter()
+
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                result.attempts = attempt + 1
+                result.error = None
+                try:
+                    result.status, extractor = await self._get(username)
+                    result.bio, result.usernames = extractor.bio, extractor.usernames
+                    if result.status < 500:
+                        break
+                except httpx.HTTPError as e:
+                    result.error = '{}: {}'.format(type(e).__name__, e)
+
+                if attempt < self.retries:
+                    await asyncio.sleep(SCRAPE_RETRY_DELAY * 2 ** attempt)
+
+        result.latency = time.perf_counter() - start
+        return result
+
+    async def fetch_many(self, usernames):
+        """Scrapes several usernames concurrently, returning the results in the same order"""
+        return await asyncio.gather(*(self.fetch(username) for username in usernames))
+
+    def _run(self, coroutine):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(coroutine)
+
+    def scrape(self, username):
+        """Blocking version of fetch()"""
+        return self._run(self.fetch(username))
+
+    def scrape_many(self, usernames):
+        """Blocking version of fetch_many()"""
+        return self._run(self.fetch_many(usernames))
+
+    def close(self):
+        if self.client is not None:
+            self._run(self.client.aclose())
+            self.client = None
+        if self.loop is not None:
+            self.loop.close()
+            self.loop = None
+
+
+_scraper = None
+
+
+def scrape_bio(username):
+    """Scrapes a username with a scraper that is shared between calls"""
+    global _scraper
+    if _scraper is None:
+        _scraper = BioScraper()
+    return _scraper.scrape(username)
+
+
+def summarize(results):
+    """Aggregates a list of ScrapeResults into a dict of stats"""
+    latencies = sorted(result.latency for result in results)
+    statuses = {}
+    for result in results:
+        key = result.status if result.error is None else result.error.split(':')[0]
+        statuses[key] = statuses.get(key, 0) + 1
+
+    def percentile(p):
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        'count': len(results),
+        'ok': sum(1 for result in results if result.ok),
+        'retried': sum(1 for result in results if result.attempts > 1),
+        'statuses': statuses,
+        'mean': sum(latencies) / len(latencies) if latencies else 0,
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'max': latencies[-1] if latencies else 0,
+    }
+
+
+if __name__ == '__main__':
+    # usage: python scraper.py [rounds] username...
+    args = sys.argv[1:]
+    rounds = int(args.pop(0)) if args and args[0].isdigit() else 1
+    usernames = args or ['durov', 'telegram']
+
+    scraper = BioScraper()
+    print('HTTP/2:', HTTP2_AVAILABLE)
+
+    results = []
+    start = time.perf_counter()
+    for i in range(rounds):
+        results.extend(scraper.scrape_many(usernames))
+    elapsed = time.perf_counter() - start
+    scraper.close()
+
+    for result in results[:len(usernames)]:
+        print(result)
+
+    stats = summarize(results)
+    print('{count} requests ({ok} ok, {retried} retried) in {:.2f}s'.format(elapsed, **stats))
+    print('latency: mean {mean:.3f}s, p50 {p50:.3f}s, p95 {p95:.3f}s, max {max:.3f}s'.format(**stats))
+    print('statuses:', stats['statuses'])
@@ -0,0 +1,133 @@
+import matrix
+
+
+class SimulationResult:
+    """The best chain that a set of hypothetical link changes would give"""
+    def __init__(self, link_changes, chain, valid_length, baseline=None):
+        # [(linker, linked, state)]
+        self.link_changes = link_changes
+        self.chain = chain
+        self.length = len(chain)
+        self.valid_length = valid_length
+        self.length_gain = self.length - baseline.length if baseline else 0
+        self.valid_gain = self.valid_length - baseline.valid_length if baseline else 0
+
+    def sort_key(self):
+        return (-self.valid_gain, -self.length_gain, len(self.link_changes))
+
+
+class Simulator:
+    """
+    Answers "what if these links changed?" about a LinkMatrix without changing it
+    Every evaluation runs the chain engine on a LinkOverlay of link_matrix, so nothing is saved and
+    no joined timestamps are given out
+    branches: the chains other than the best one, as found by Database.update_best_chain()
+    head: the first user in the best chain with a username, since bios can only link to usernames
+    """
+    def __init__(self, link_matrix, branches, joined, end_node, head):
+        self.matrix = link_matrix
+        self.branches = branches
+        self.joined = joined
+        self.end_node = end_node
+        self.head = head
+        self.baseline = None
+        self.baseline = self.evaluate([])
+
+    def evaluate(self, link_changes):
+        """Returns a SimulationResult for a list of (linker, linked, state) changes"""
+        overlay = matrix.LinkOverlay(self.matrix)
+        for linker, linked, state in link_changes:
+            overlay.set_link_to(linker, linked, state)
+
+        chains = overlay.get_chains_ending_on(self.end_node)
+        chain = chains[overlay.get_best_chain_index(chains, self.joined)]
+        return SimulationResult(
+            link_changes,
+            chain,
+            overlay.chain_valid_length(chain),
+            self.baseline
+        )
+
+    def evaluate_many(self, candidates):
+        """Evaluates a list of candidate change lists, returns the results from most to least useful"""
+        results = [self.evaluate(link_changes) for link_changes in candidates]
+        results.sort(key=SimulationResult.sort_key)
+        return results
+
+    def evaluate_fix(self, linker, linked):
+        """What if linker fixed their bio to only link to linked?"""
+        link_changes = [
+            (linker, old_linked, matrix.State.NONE)
+            for old_linked in self.matrix.get_links_to(linker)
+            if old_linked != linked
+        ]
+        link_changes.append((linker, linked, matrix.State.REAL))
+        return self.evaluate(link_changes)
+
+    def get_repair_candidates(self):
+        """
+        Returns single link fixes worth trying:
+        broken links in the best chain, and the users where each branch splits off linking to the head
+        """
+        best_chain = self.baseline.chain
+        candidates = []
+        seen = set()
+
+        def add(linker, linked):
+            if (linker, linked) not in seen and linker != linked:
+                seen.add((linker, linked))
+                candidates.append([(linker, linked, matrix.State.REAL)])
+
+        for i in range(1, len(best_chain)):
+            if self.matrix.get_link_to(best_chain[i-1], best_chain[i]) is not matrix.State.REAL:
+                add(best_chain[i-1], best_chain[i])
+
+        best_chain_set = set(best_chain)
+        for branch in self.branches:
+            branch_point_i, merger_i = self.matrix.chain_get_merge_points(best_chain, branch)
+            if branch[merger_i] in best_chain_set:
+                continue
+            add(branch[merger_i], self.head)
+
+        return candidates
+
+    def suggest_repairs(self, count=5):
+        """Returns up to count repairs that would make the chain longer, best first"""
+        results = self.evaluate_many(self.get_repair_candidates())
+        return [result for result in results if result.valid_gain > 0 or result.length_gain > 0][:count]
+
+
+if __name__ == '__main__':
+    link_matrix = matrix.LinkMatrix()
+    # E <- D <- C <- B <- A, with C's link to D broken, and X -> Y -> Z -> D as a branch
+    for linker, linked, state in (
+        ('A', 'B', matrix.State.REAL),
+        ('B', 'C', matrix.State.REAL),
+        ('C', 'D', matrix.State.DEAD),
+        ('D', 'E', matrix.State.REAL),
+        ('X', 'Y', matrix.State.REAL),
+        ('Y', 'Z', matrix.State.REAL),
+        ('Z', 'D', matrix.State.REAL),
+    ):
+        link_matrix.set_link_to(linker, linked, state)
+
+    chains = link_matrix.get_chains_ending_on('E')
+    best_index = link_matrix.get_best_chain_index(chains, {})
+    branches = chains[:best_index] + chains[best_index+1:]
+
+    simulator = Simulator(link_matrix, branches, {}, 'E', 'X')
+    assert simulator.baseline.chain == ['X', 'Y', 'Z', 'D', 'E']
+
+    # fixing C's bio would make A's chain the best one
+    result = simulator.evaluate_fix('C', 'D')
+    assert result.chain == ['A', 'B', 'C', 'D', 'E'] and result.valid_gain == 0
+    assert link_matrix.get_link_to('C', 'D') is matrix.State.DEAD
+
+    result = simulator.evaluate_fix('A', 'X')
+    assert result.chain == ['A', 'X', 'Y', 'Z', 'D', 'E'] and result.valid_gain == 1
+
+    # if X had no username, the branch could only be joined by linking to Y
+    assert [('C', 'Y', matrix.State.REAL)] in Simulator(link_matrix, branches, {}, 'E', 'Y').get_repair_candidates()
+
+    for result in simulator.suggest_repairs():
+        print(result.link_changes, result.chain, result.valid_gain, result.length_gain)
@@ -0,0 +1,60 @@
+import random
+
+import matrix
+
+
+def make_matrix(size, seed=0, strands=8, extend=0.9, extra_links=0.02, dead_links=0.05, loops=0.005):
+    """
+    Builds a random LinkMatrix that looks like a group playing the game, with user IDs '0' to str(size-1)
+    '0' is the end node, and `strands` chains grow towards it side by side. Every other user links to
+    someone who joined before them: usually the newest user of a random strand (extend), otherwise
+    someone random, which starts a branch
+    extra_links: chance of a user having a second link
+    dead_links: chance of any link being dead
+    loops: chance of a user linking to someone who joined after them
+    """
+    rng = random.Random(seed)
+    link_matrix = matrix.LinkMatrix()
+
+    def link(linker, linked):
+        state = matrix.State.DEAD if rng.random() < dead_links else matrix.State.REAL
+        link_matrix.set_link_to(str(linker), str(linked), state)
+
+    # the newest user of each strand
+    heads = [0] * strands
+    for i in range(1, size):
+        strand = rng.randrange(strands)
+        link(i, heads[strand] if rng.random() < extend else rng.randrange(i))
+        heads[strand] = i
+        if rng.random() < extra_links:
+            link(i, rng.randrange(i))
+        if rng.random() < loops and i < size - 1:
+            link(i, rng.randrange(i + 1, size))
+
+    return link_matrix
+
+
+def make_joined(size, seed=0, spread=None):
+    """
+    Returns random {user_id: joined timestamp} for a matrix made by make_matrix()
+    Timestamps are picked from `spread` values (size // 4 by default) so that there are plenty of ties
+    """
+    rng = random.Random(seed)
+    spread = spread or max(1, size // 4)
+    return {str(i): rng.randrange(spread) for i in range(size) if rng.random() < 0.8}
+
+
+def make_random_matrix(size, links, seed=0, dead_links=0.3):
+    """
+    Builds a LinkMatrix with `links` links between random users '0' to str(size-1)
+    Unlike make_matrix(), links can point anywhere, so these are full of loops
+    """
+    rng = random.Random(seed)
+    link_matrix = matrix.LinkMatrix()
+    for i in range(links):
+        linker, linked = rng.randrange(size), rng.randrange(size)
+        if linker == linked:
+            continue
+        state = matrix.State.DEAD if rng.random() < dead_links else matrix.State.REAL
+        link_matrix.set_link_to(str(linker), str(linked), state)
+    return link_matrix
@@ -1,15 +1,9 @@
 import changes
-import html
-import requests
-import re
+from scraper import scrape_bio
 from util import *
 import telegram
 
 
-RE_SCRAPE_BIO = re.compile(r'<meta +property="og:description" +content="(.+?)".*>')
-RE_USERNAME = re.compile(r'@([a-zA-Z][\w\d]{4,31})')
-
-
 class User:
     defaults = {
         'bio': [],
@@ -59,6 +53,8 @@ class User:
             new_username = member.user.username or ''
             if not new_username and member.status.lower() in ['left', 'kicked']:
                 raise RuntimeError('user left/kicked, no username available')
+            if member.status.lower() not in ['left', 'kicked']:
+                self.username_fetch_failed = False
             if new_username != self.username:
                 if new_username.lower() != self.username.lower():
                     pending_changes.append(changes.Username(self.id, self.username, new_username))
@@ -73,23 +69,21 @@ class User:
 
     def update_bio(self):
         if self.username:
-            r = requests.get("http://t.me/" + self.username)
-            if not r.ok:
-                print("  Request for bio failed (" + r.status_code + ")")
+            result = scrape_bio(self.username)
+            if not result.ok:
+                print('  Request for bio failed ({})'.format(result.error or result.status))
                 return []
 
-            bio = RE_SCRAPE_BIO.findall(r.text)
-            if not bio:
+            if result.bio is None:
                 print('  Failed to scrape bio tag')
                 return []
+            bio_usernames = result.usernames
         else:
             print('  Tried to scrape blank username')
-            bio = ['']
+            bio_usernames = []
 
         new_bio = {}
-        #TODO
-        #for bio_username in RE_USERNAME.findall(html.unescape(bio[0])):
-        for bio_username in RE_USERNAME.findall(bio[0]):
+        for bio_username in bio_usernames:
             if bio_username.lower() == self.username.lower():
                 continue
             new_bio[bio_username.lower()] = bio_username
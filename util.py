@@ -2,12 +2,45 @@ import time
 from file_string import FileString
 
 ADMIN = "millicow"
+ADMIN_CHAT_ID = 232787997
 TOKEN = ""
 END_NODE = '16507419'
 CHAT_ID = -1001180504638
 LAST_PIN = FileString('last_pin.txt')
 BULLET = '. '
 BULLET_2 = '  - '
+# seconds without new changes before the chain is rebuilt
+DEBOUNCE_SECONDS = 10
+# longest a change can wait before the chain is rebuilt anyway
+MAX_LATENCY_SECONDS = 120
+# seconds before a user in the chain whose username couldn't be fetched is rechecked, doubled for each recheck
+FETCH_RETRY_DELAY = 60
+FETCH_RETRY_MAX_DELAY = 60 * 60
+# seconds that a command's rate limit applies over
+COMMAND_RATE_WINDOW = 60
+# processes to find and score chains with, 0 to do it all in the main thread
+PARALLEL_PROCESSES = 0
+# watch memory use and warn the admin when it keeps growing
+MEMORY_DIAGNOSTICS = True
+# seconds between memory reports
+MEMORY_SNAPSHOT_INTERVAL = 60 * 60
+# seconds of each interval that allocations are traced for, tracing slows the bot down ~4x while it runs
+MEMORY_SAMPLE_SECONDS = 30
+# bytes of RSS growth that the admin is warned about
+MEMORY_ALARM_THRESHOLD = 32 * 1024 * 1024
+# users per page of /chain
+CHAIN_PAGE_SIZE = 25
+# seconds over which overdue refreshes are spread after a restart
+RESTART_SPREAD_SECONDS = 300
+SNAPSHOT_VERSION = 1
+SCRAPE_BASE_URL = 'https://t.me/'
+# seconds before a bio request is given up on
+SCRAPE_TIMEOUT = 10
+SCRAPE_RETRIES = 2
+# seconds to wait before the first retry, doubled for each one after
+SCRAPE_RETRY_DELAY = 0.5
+# most bio requests that can be in flight at once
+SCRAPE_CONCURRENCY = 8
 
 
 def get_current_timestamp():
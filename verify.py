@@ -0,0 +1,203 @@
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import matrix
+import parallel
+import synthetic
+
+
+# The reference engine reads links_from and links_to directly and shares no code with LinkMatrix,
+# so that a change to a LinkMatrix method can't change the reference along with the engines
+
+def reference_chains_ending_on(link_matrix, end_node):
+    """The chain search as it was originally written, checking every step against the whole chain"""
+    found_chains = []
+
+    pending_chains = [[end_node]]
+
+    while pending_chains:
+        this_chain = pending_chains.pop()
+        last_link = this_chain[-1]
+        is_end = True
+
+        for next_link, state in link_matrix.links_from.get(last_link, {}).items():
+            if state is matrix.State.NONE or next_link in this_chain:
+                continue
+
+            is_end = False
+            new_chain = this_chain[:]
+            new_chain.append(next_link)
+            pending_chains.append(new_chain)
+
+        if is_end:
+            found_chains.append(this_chain[::-1])
+
+    return found_chains
+
+
+def reference_tally(link_matrix, chain):
+    """Returns (real links, dead links) in chain"""
+    real, dead = 0, 0
+    for i in range(1, len(chain)):
+        state = link_matrix.links_to.get(chain[i-1], {}).get(chain[i], matrix.State.NONE)
+        if state is matrix.State.REAL:
+            real += 1
+        elif state is matrix.State.DEAD:
+            dead += 1
+    return real, dead
+
+
+def reference_merge_points(chain1, chain2):
+    """Finds the index of the nodes just before the merge of two chains"""
+    i1 = len(chain1)-1
+    i2 = len(chain2)-1
+
+    while chain1[i1] == chain2[i2] and (i1 > 0 or i2 > 0):
+        i1 = max(i1 - 1, 0)
+        i2 = max(i2 - 1, 0)
+
+    return i1, i2
+
+
+def reference_best_index(link_matrix, found_chains, joined):
+    """The chain selection as it was originally written in Database.update_best_chain()"""
+    best_index = 0
+    for index, this_chain in enumerate(found_chains):
+        if index == best_index:
+            continue
+
+        this_valid, this_broken = reference_tally(link_matrix, found_chains[index])
+        best_valid, best_broken = reference_tally(link_matrix, found_chains[best_index])
+
+        if this_valid > best_valid or (this_valid == best_valid and this_broken < best_broken):
+            best_index = index
+        elif this_valid == best_valid and this_broken == best_broken:
+            head1i, head2i = reference_merge_points(found_chains[best_index], this_chain)
+            head1_joined = joined.get(found_chains[best_index][head1i]) or 0
+            head2_joined = joined.get(this_chain[head2i]) or 0
+            if head2_joined < head1_joined:
+                best_index = index
+
+    return best_index
+
+
+def reference_engine(link_matrix, end_node, joined):
+    chains = reference_chains_ending_on(link_matrix, end_node)
+    return chains[reference_best_index(link_matrix, chains, joined)], chains
+
+
+# engines take (link_matrix, end_node, joined) and return (best chain, every chain or None)
+def serial_engine(link_matrix, end_node, joined):
+    chains = link_matrix.get_chains_ending_on(end_node)
+    return chains[link_matrix.get_best_chain_index(chains, joined)], chains
+
+
+def overlay_engine(link_matrix, end_node, joined):
+    return serial_engine(matrix.LinkOverlay(link_matrix), end_node, joined)
+
+
+def parallel_engine(link_matrix, end_node, joined):
+    chains, best_index = parallel.get_chains_parallel(link_matrix, end_node, joined, 2)
+    return chains[best_index], chains
+
+
+ENGINES = {
+    'serial': serial_engine,
+    'overlay': overlay_engine,
+    'parallel': parallel_engine,
+}
+
+
+def random_case(rng):
+    """Returns a random (link_matrix, end node, joined) with dead links, loops and plenty of ties"""
+    seed = rng.randrange(2 ** 32)
+    if rng.random() < 0.5:
+        size = rng.randrange(2, 300)
+        link_matrix = synthetic.make_matrix(
+            size,
+            seed=seed,
+            strands=rng.randrange(1, 6),
+            extend=rng.random(),
+            extra_links=rng.random() * 0.2,
+            dead_links=rng.random() * 0.5,
+            loops=rng.random() * 0.1
+        )
+    else:
+        size = rng.randrange(2, 12)
+        link_matrix = synthetic.make_random_matrix(size, rng.randrange(size * 3), seed=seed)
+
+    # a tiny spread of joined timestamps so that merge point tie-breaks come up a lot
+    joined = synthetic.make_joined(size, seed=seed, spread=rng.randrange(1, 4))
+    return link_matrix, '0', joined
+
+
+def verify(trials, seed=0, engines=ENGINES):
+    """
+    Runs every engine against the reference on `trials` random cases
+    Raises AssertionError on the first case where they disagree, returns {engine name: [speed ratios]}
+    """
+    rng = random.Random(seed)
+    ratios = defaultdict(list)
+
+    for trial in range(trials):
+        link_matrix, end_node, joined = random_case(rng)
+
+        start = time.perf_counter()
+        expected_best, expected_chains = reference_engine(link_matrix, end_node, joined)
+        reference_time = time.perf_counter() - start
+
+        for name, engine in engines.items():
+            start = time.perf_counter()
+            best, chains = engine(link_matrix, end_node, joined)
+            engine_time = time.perf_counter() - start
+
+            assert best == expected_best, '{} picked {} instead of {} (trial {}, seed {})'.format(
+                name, best, expected_best, trial, seed
+            )
+            if chains is not None:
+                assert chains == expected_chains, '{} found different chains (trial {}, seed {})'.format(
+                    name, trial, seed
+                )
+            ratios[name].append(reference_time / engine_time if engine_time else 1)
+
+    return ratios
+
+
+def benchmark(size, seed=0, engines=ENGINES):
+    """Times every engine against the reference on one big synthetic group, returns {engine name: seconds}"""
+    link_matrix = synthetic.make_matrix(size, seed=seed, strands=16, extra_links=0.03)
+    joined = synthetic.make_joined(size, seed=seed)
+
+    times = {}
+    start = time.perf_counter()
+    expected_best, expected_chains = reference_engine(link_matrix, '0', joined)
+    times['reference'] = time.perf_counter() - start
+
+    for name, engine in engines.items():
+        start = time.perf_counter()
+        best, chains = engine(link_matrix, '0', joined)
+        times[name] = time.perf_counter() - start
+        assert best == expected_best, '{} picked a different chain on the benchmark group'.format(name)
+
+    return times
+
+
+if __name__ == '__main__':
+    # usage: python verify.py [trials] [seed] [benchmark size]
+    trials = int(sys.argv[1]) if sys.argv[1:] else 200
+    seed = int(sys.argv[2]) if sys.argv[2:] else 0
+    size = int(sys.argv[3]) if sys.argv[3:] else 20000
+
+    ratios = verify(trials, seed)
+    for name, engine_ratios in ratios.items():
+        print('{:>8}: {} random groups matched, median speed vs reference {:.2f}x'.format(
+            name, len(engine_ratios), statistics.median(engine_ratios)
+        ))
+
+    times = benchmark(size, seed)
+    print('{} users:'.format(size))
+    for name, seconds in times.items():
+        print('{:>10}: {:.2f}s ({:.2f}x)'.format(name, seconds, times['reference'] / seconds))